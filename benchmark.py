@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the flame graph view generation.
+"""
+
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from argparse import Namespace
+from argparse import RawDescriptionHelpFormatter
+from random import Random
+from textwrap import dedent
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import flameview
+
+# pylint: disable=missing-docstring
+
+
+def _main() -> None:
+    parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter,
+                            description='Benchmark the flamegraph view generation.',
+                            epilog=dedent("""
+        Generates a synthetic flamegraph file, and times each stage of
+        generating its HTML view (using the same stages as flameview.py).
+
+        Each result is a JSON object containing the parameters, the time and
+        the peak traced memory of each stage, and the output HTML size. Results
+        of different versions for the same parameters can be compared to catch
+        performance regressions.
+    """))
+    parser.add_argument('--lines', metavar='COUNT', default=100000, type=int,
+                        help='The number of lines in the generated input; default: 100000')
+
+    parser.add_argument('--depth', metavar='DEPTH', default=20, type=int,
+                        help='The maximal depth of the generated stacks; default: 20')
+
+    parser.add_argument('--fanout', metavar='FANOUT', default=8, type=int,
+                        help='The maximal number of children of each generated frame; '
+                        'default: 8')
+
+    parser.add_argument('--names', metavar='COUNT', default=1000, type=int,
+                        help='The number of distinct frame names; fewer names mean more '
+                        'reuse of the same name in different stacks, which creates '
+                        'larger groups; default: 1000')
+
+    parser.add_argument('--seed', metavar='SEED', default=0, type=int,
+                        help='The seed for generating the input; default: 0')
+
+    parser.add_argument('--renderer', metavar='RENDERER', default='dom',
+                        choices=['dom', 'lazy', 'canvas'],
+                        help='The renderer to use; default: "dom"')
+
+    parser.add_argument('--minpercent', metavar='PERCENT', default='0.1', type=float,
+                        help='The minimal percent of the entries to display; default: 0.1')
+
+    parser.add_argument('--repeat', metavar='COUNT', default=1, type=int,
+                        help='The number of times to run the stages, reporting the fastest '
+                        'time of each stage; default: 1')
+
+    parser.add_argument('--input', metavar='FLAMEGRAPH',
+                        help='Benchmark an existing flamegraph file instead of a generated one')
+
+    parser.add_argument('--save', metavar='JSON',
+                        help='Append the result to a JSON lines file')
+
+    parser.add_argument('--baseline', metavar='JSON',
+                        help='Compare the result with the last result with the same parameters '
+                        'in a JSON lines file')
+
+    parser.add_argument('--tolerance', metavar='RATIO', default=1.5, type=float,
+                        help='Exit with an error if any stage is slower than the baseline '
+                        'by more than this ratio; default: 1.5')
+
+    parser.add_argument('--nomemory', action='store_true',
+                        help='If specified, skip the additional (slower) run of the stages '
+                        'which measures the peak traced memory of each stage')
+
+    args = parser.parse_args()
+
+    if args.input is not None:
+        result = _benchmark_file(args, args.input)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'synthetic.fg')
+            with open(path, 'w') as file:
+                _generate_input(file, args)
+            result = _benchmark_file(args, path)
+
+    _print_result(result)
+
+    is_regression = False
+    if args.baseline is not None:
+        baseline = _find_baseline(args.baseline, result['parameters'])
+        if baseline is None:
+            sys.stderr.write('benchmark.py: %s: warning: no result with the same parameters\n'
+                             % args.baseline)
+        else:
+            is_regression = _compare_results(baseline, result, args.tolerance)
+
+    if args.save is not None:
+        with open(args.save, 'a') as file:
+            file.write(json.dumps(result) + '\n')
+
+    if is_regression:
+        sys.exit(1)
+
+
+# The name of each frame is chosen by hashing its path of child indices, so the same stack prefix
+# always gets the same names.
+def _generate_input(file: io.TextIOBase, args: Namespace) -> None:
+    random = Random(args.seed)
+    for _line in range(args.lines):
+        frames: List[str] = []
+        path_hash = args.seed
+        for _level in range(random.randint(1, args.depth)):
+            child = random.randrange(args.fanout)
+            path_hash = (path_hash * 1000003 + child + 1) & 0xFFFFFFFFFFFF
+            frames.append('function_%s' % (path_hash % args.names))
+        file.write('%s %s\n' % (';'.join(frames), random.randint(1, 100)))
+
+
+Stage = Tuple[str, Callable[[], Any]]
+
+
+def _benchmark_file(args: Namespace, path: str) -> Dict[str, Any]:
+    stages_seconds: Dict[str, float] = {}
+    html_size = 0
+    cells_count = 0
+    for _repeat in range(max(args.repeat, 1)):
+        state: Dict[str, Any] = {}
+        for name, function in _pipeline_stages(args, path, state):
+            start = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - start
+            stages_seconds[name] = min(stages_seconds.get(name, seconds), seconds)
+        html_size = state['html_size']
+        cells_count = sum(len(row) for row in state['rows'])
+
+    stages_memory = None if args.nomemory else _measure_stages_memory(args, path)
+
+    parameters: Dict[str, Any] = {'renderer': args.renderer, 'minpercent': args.minpercent}
+    if args.input is None:
+        parameters.update({'lines': args.lines, 'depth': args.depth, 'fanout': args.fanout,
+                           'names': args.names, 'seed': args.seed})
+    else:
+        parameters['input'] = os.path.abspath(args.input)
+
+    return {'version': flameview.VERSION, 'revision': _flameview_revision(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'parameters': parameters, 'input_size': os.path.getsize(path), 'cells': cells_count,
+            'stages': stages_seconds, 'total': sum(stages_seconds.values()),
+            'stages_memory': stages_memory, 'html_size': html_size}
+
+
+# The git revision of flameview.py, as the version is not changed by every commit.
+def _flameview_revision() -> Optional[str]:
+    try:
+        completed = subprocess.run(['git', 'describe', '--always', '--dirty'],
+                                   cwd=os.path.dirname(os.path.abspath(flameview.__file__)),
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   universal_newlines=True, check=False)
+    except OSError:
+        return None
+    if completed.returncode != 0:
+        return None
+    return completed.stdout.strip() or None
+
+
+# Tracing slows the stages down, so this is a separate run. Before Python 3.9, the traced peak
+# can't be reset, so the peak of each stage is the peak so far.
+def _measure_stages_memory(args: Namespace, path: str) -> Dict[str, int]:
+    tracemalloc.start()
+    try:
+        profiler = flameview.StageProfiler()
+        for name, function in _pipeline_stages(args, path, {}):
+            function()
+            profiler.stage(name, None, {})
+    finally:
+        tracemalloc.stop()
+    return {stage['stage']: stage['peak_traced_bytes'] for stage in profiler.stages}
+
+
+def _pipeline_stages(args: Namespace, path: str, state: Dict[str, Any]) -> List[Stage]:
+    # pylint: disable=protected-access
+    flameview_args = flameview._parse_args(['--renderer', args.renderer,
+                                            '--minpercent', str(args.minpercent), path])
+
+    def load() -> None:
+        state['root'] = flameview._load_root(flameview_args,
+                                             flameview._stack_transform(flameview_args))
+
+    def size_tree_names() -> None:
+        state['sizes'] = flameview._size_tree_names(state['root'])
+
+    def compute_tree_groups() -> None:
+        state['groups'] = flameview._compute_tree_groups(state['root'], state['sizes'])
+
+    def compute_tree_column_sizes() -> None:
+        state['column_sizes'] = flameview._compute_tree_column_sizes(state['root'],
+                                                                     flameview._by_name)
+
+    def compute_tree_rows() -> None:
+        state['rows'] = flameview._compute_tree_rows(state['root'])
+
+    def print_output_file() -> None:
+        output = io.StringIO()
+        flameview._print_output_file(output, flameview_args, state['groups'],
+                                     state['column_sizes'], state['rows'], None)
+        state['html_size'] = len(output.getvalue().encode('utf-8'))
+
+    return [
+        ('load_data_file', load),
+        ('add_self_nodes', lambda: flameview._add_self_nodes(state['root'])),
+        ('compute_sizes', lambda: flameview._compute_sizes(state['root'])),
+        ('prune_small_nodes',
+         lambda: flameview._prune_small_nodes(state['root'],
+                                              flameview._prune_percent(flameview_args))),
+        ('size_tree_names', size_tree_names),
+        ('compute_tree_groups', compute_tree_groups),
+        ('compute_tree_column_sizes', compute_tree_column_sizes),
+        ('compute_tree_rows', compute_tree_rows),
+        ('print_output_file', print_output_file),
+    ]
+
+
+def _print_result(result: Dict[str, Any]) -> None:
+    print('flameview.py version %s (%s) at %s, python %s'
+          % (result['version'], _result_revision(result), result.get('time'), result['python']))
+    print('parameters: %s' % ', '.join(['%s=%s' % item
+                                        for item in sorted(result['parameters'].items())]))
+    print('input: %s bytes, %s cells' % (result['input_size'], result['cells']))
+    stages_memory = result['stages_memory'] or {}
+    for name, seconds in result['stages'].items():
+        if name in stages_memory:
+            print('  %-28s %9.3f s %9.1f MB' % (name, seconds, stages_memory[name] / (1 << 20)))
+        else:
+            print('  %-28s %9.3f s' % (name, seconds))
+    print('  %-28s %9.3f s' % ('total', result['total']))
+    print('html size: %s bytes' % result['html_size'])
+
+
+def _result_revision(result: Dict[str, Any]) -> str:
+    return result.get('revision') or 'unknown revision'
+
+
+def _find_baseline(path: str, parameters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    baseline = None
+    try:
+        with open(path, 'r') as file:
+            for line in file:
+                result = json.loads(line)
+                if result['parameters'] == parameters:
+                    baseline = result
+    except FileNotFoundError:
+        return None
+    return baseline
+
+
+def _compare_results(baseline: Dict[str, Any], result: Dict[str, Any], tolerance: float) -> bool:
+    print('compared with version %s (%s) at %s:'
+          % (baseline['version'], _result_revision(baseline), baseline.get('time')))
+    is_regression = False
+    for name, seconds in result['stages'].items():
+        base_seconds = baseline['stages'].get(name)
+        if not base_seconds:
+            continue
+        ratio = seconds / base_seconds
+        is_slower = ratio > tolerance
+        is_regression = is_regression or is_slower
+        print('  %-28s %8.2fx%s' % (name, ratio, ' REGRESSION' if is_slower else ''))
+    if baseline['html_size']:
+        print('  %-28s %8.2fx' % ('html size', result['html_size'] / baseline['html_size']))
+    return is_regression
+
+
+if __name__ == '__main__':
+    _main()
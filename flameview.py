@@ -4,21 +4,46 @@
 Generate a flame graph view.
 """
 
+import gzip
+import io
+import json
+import math
+import mmap
+import os
 import re
+import struct
 import sys
+import time
+import tracemalloc
+import zlib
+from base64 import b64encode
 from argparse import ArgumentParser
+from argparse import ArgumentTypeError
 from argparse import Namespace
 from argparse import RawDescriptionHelpFormatter
-from random import random
-from random import seed
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from glob import glob
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from itertools import repeat
+from sys import intern
 from textwrap import dedent
 from typing import Any
+from typing import BinaryIO
 from typing import Callable
 from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
 from typing import TextIO
 from typing import Tuple
+from typing import cast
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
 
 
 VERSION = "0.1-b6"
@@ -31,14 +56,21 @@ VERSION = "0.1-b6"
 
 
 class Node:
+    __slots__ = ('index', 'size', 'difference', 'tooltip_html', 'total_size', 'total_difference',
+                 'name', 'label', 'klass', 'column', 'columns_span', 'group', 'nodes',
+                 'time_sizes', 'color')
+
     _next_index = 0
 
-    def __init__(self, name: str, size: Optional[float] = None, tooltip_html: str = '') -> None:
+    def __init__(self, name: str, size: Optional[float] = None, tooltip_html: str = '',
+                 difference: Optional[float] = None) -> None:
         self.index = Node._next_index
         self.size = size
+        self.difference = difference
         self.tooltip_html = tooltip_html
         Node._next_index += 1
         self.total_size = 0.0
+        self.total_difference: Optional[float] = None
         self.name = name
         self.label = name
         self.klass = 'sum'
@@ -46,21 +78,136 @@ class Node:
         self.columns_span = 0
         self.group: Optional[str] = None
         self.nodes: Dict[str, 'Node'] = {}
+        self.time_sizes: Optional[Dict[int, float]] = None
+        self.color = 0
+
+
+def _main() -> None:
+    args = _parse_args(sys.argv[1:])
+
+    profiler = StageProfiler() if args.profile_stages or args.profile_json else None
+
+    transform = _stack_transform(args)
+
+    timeline: Optional[Timeline] = None
+    if args.timed:
+        root, timeline = _load_timed_data(args.input, args.strict, args.format, transform,
+                                          args.timebuckets)
+    else:
+        root = _load_root(args, transform)
+    _profile_stage(profiler, 'load', root)
+
+    if args.summary is not None:
+        _print_summary(args.summary, args.sizename, root)
+        _profile_stage(profiler, 'print_summary')
+    if args.reverse:
+        root = _reverse_tree(root)
+        _profile_stage(profiler, 'reverse_tree', root)
+
+    _add_self_nodes(root)
+    _profile_stage(profiler, 'add_self_nodes', root)
+    _compute_sizes(root)
+    _profile_stage(profiler, 'compute_sizes')
+
+    sort_key = {'name': _by_name, 'size': _by_size, 'input': _by_input}[args.sortby]
+    if args.serve is not None:
+        if profiler is not None:
+            profiler.report(args.profile_json)
+        _serve_graph(args, root, sort_key)
+        return
+
+    _prune_small_nodes(root, _prune_percent(args))
+    _profile_stage(profiler, 'prune_small_nodes', root)
+    sizes = _size_tree_names(root)
+    _profile_stage(profiler, 'size_tree_names')
+    groups = _compute_tree_groups(root, sizes)
+    _profile_stage(profiler, 'compute_tree_groups')
+
+    column_sizes = _compute_tree_column_sizes(root, sort_key)
+    _profile_stage(profiler, 'compute_tree_column_sizes', columns=len(column_sizes))
+    rows = _compute_tree_rows(root)
+    _profile_stage(profiler, 'compute_tree_rows', cells=sum(len(row) for row in rows))
 
+    _print_output_data(args, groups, column_sizes, rows, timeline)
+    _profile_stage(profiler, 'print_output_data')
 
-def _main() -> None:  # pylint: disable=too-many-locals
+    if profiler is not None:
+        profiler.report(args.profile_json)
+
+
+def _parse_args(argv: List[str]) -> Namespace:
     parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter,
                             description='Generate a flamegraph view.', epilog=dedent("""
         INPUT: A flamegraph file. Each line must be in the format:
 
             name;...;name size [difference] [#tooltip_html]
 
+        The stack of names of each line may be transformed (--rename,
+        --stripprefix, --include, --exclude, --collapserecursion and
+        --maxdepth, applied in this order) while it is read.
+
+        If --timed is specified, each line must start with a timestamp (in
+        seconds) followed by white space, and the HTML will contain a timeline
+        for restricting the graph to a range of time.
+
+        If any line specifies a difference (the change in the size compared to
+        some baseline), a differential graph is generated, where cells are
+        colored red for increased sizes and blue for decreased sizes.
+
+        The file may be gzip or zstd compressed (the latter requires the
+        zstandard module).
+
+        Alternatively (--format), the input may be the text output of "perf
+        script", a pprof protobuf profile, a speedscope JSON profile or a Chrome
+        .cpuprofile JSON profile. By default, the format is detected from the
+        file name and its first bytes. The timestamps of perf script samples
+        and of Chrome and evented speedscope profiles are used by --timed.
+
         OUTPUT: An HTML file visualizing the flame graph.
     """))
+    _add_graph_arguments(parser)
+    _add_output_arguments(parser)
+
+    parser.add_argument('--version', action='store_true',
+                        help='Print the version information (%s) and exit' % VERSION)
+
+    _add_input_arguments(parser)
+    _add_transform_arguments(parser)
+
+    parser.add_argument('--profile-stages', action='store_true',
+                        help='If specified, report the wall time, CPU time, peak memory and '
+                        'the nodes, cells and columns counts after each stage to the '
+                        'standard error')
+
+    parser.add_argument('--profile-json', metavar='JSON',
+                        help='Write the --profile-stages report to a JSON file instead of the '
+                        'standard error (implies --profile-stages)')
+
+    parser.add_argument('input', metavar='FLAMEGRAPH', nargs='*',
+                        help='The flamegraph data file(s) or glob pattern(s) to read '
+                        '(possibly compressed); default: "-", read from standard input')
+
+    args = parser.parse_args(argv)
+
+    if args.version:
+        print('flameview.py: version %s' % VERSION)
+        sys.exit(0)
+
+    _check_args(args)
+    return args
+
+
+def _add_graph_arguments(parser: ArgumentParser) -> None:
     parser.add_argument('--minpercent', metavar='PERCENT', default='0.1', type=float,
                         help='The minimal percent of the entries to display; '
                         'default: 0.1 (1/1000 of the total)')
 
+    parser.add_argument('--detailpercent', metavar='PERCENT', type=float,
+                        help='If specified, embed the cells down to this (smaller) percent of '
+                        'the entries, and only display the cells which are at least '
+                        '--minpercent of the currently visible entries, so zooming into a cell '
+                        'reveals its details; default: None (embed only the displayed cells)')
+
     parser.add_argument('--sortby', metavar='SORT_KEY',
                         default='name', choices=['name', 'size', 'input'],
                         help='How to sort nodes:\n'
@@ -71,6 +218,23 @@ def _main() -> None:  # pylint: disable=too-many-locals
     parser.add_argument('--inverted', action='store_true',
                         help='If specified, generate an inverted (icicles) graph.')
 
+    parser.add_argument('--reverse', action='store_true',
+                        help='If specified, generate a graph of the reversed stacks, that is, '
+                        'rooted at the functions with their own (self) size, each followed by '
+                        'its callers (the input tooltips are omitted)')
+
+    parser.add_argument('--summary', metavar='TSV',
+                        help='Write a tab-separated summary of the self and total size of each '
+                        'function name, sorted by the self size, to this file')
+
+    parser.add_argument('--renderer', metavar='RENDERER', default='dom',
+                        choices=['dom', 'lazy', 'canvas'],
+                        help='How to render the graph: '
+                        'dom (default) - create all the cells in the HTML, '
+                        'lazy - only create the cells which are wide enough to be visible, '
+                        'on demand, '
+                        'canvas - draw the cells on a canvas')
+
     parser.add_argument('--title', metavar='TITLE',
                         help='An optional title for the HTML document; '
                         'default: "Flame Graph" or "Icicle Graph"')
@@ -88,149 +252,1727 @@ def _main() -> None:  # pylint: disable=too-many-locals
     parser.add_argument('--colors', metavar='PALETTE', default='hot',
                         choices=['hot', 'mem', 'io', 'red', 'green', 'blue',
                                  'aqua', 'yellow', 'purple', 'orange'],
-                        help='The color palette to use, subset of flamegraph.pl; '
+                        help='The color palette to use, subset of flamegraph.pl '
+                        '(colors are chosen by hashing the cell labels); '
                              'default: "hot", other choices: '
                              'mem, io, red, green, blue, aqua, yellow, purple, orange')
 
     parser.add_argument('--seed', metavar='SEED', default=None, type=int,
-                        help='An optional seed for repeatable random color generation; '
-                        'default: None')
+                        help='Ignored; kept for compatibility, as the colors are now '
+                        'deterministic (derived from the cell labels)')
 
-    parser.add_argument('--strict', action='store_true',
-                        help='If specified, abort with an error on invalid input lines.')
 
+def _add_output_arguments(parser: ArgumentParser) -> None:
     parser.add_argument('--output', metavar='HTML',
                         help='The HTML file to write; default: "-", write to standard output')
 
-    parser.add_argument('--version', action='store_true',
-                        help='Print the version information (%s) and exit' % VERSION)
+    parser.add_argument('--compress', action='store_true',
+                        help='If specified, embed the graph data and HTML in the output as '
+                        'compressed text, which is decompressed when the page is loaded '
+                        '(requires a modern browser)')
 
-    parser.add_argument('input', metavar='FLAMEGRAPH', nargs='?',
-                        help='The flamegraph data file to read; '
-                        'default: "-", read from standard input')
+    parser.add_argument('--gzip', action='store_true',
+                        help='If specified, gzip compress the output HTML; this is also done if '
+                        'the --output file name ends with ".gz"')
 
-    args = parser.parse_args()
+    parser.add_argument('--serve', metavar='PORT', type=int,
+                        help='If specified, serve the graph from a local HTTP server on this port '
+                        'instead of writing an HTML file; zooming into a cell fetches its '
+                        'subtree from the server, pruned relative to the size of the cell '
+                        '(always uses the canvas renderer)')
 
-    if args.version:
-        print('flameview.py: version %s' % VERSION)
-        sys.exit(0)
 
-    seed(args.seed)
+def _add_input_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument('--strict', action='store_true',
+                        help='If specified, abort with an error on invalid input lines.')
 
-    root = _load_input_data(args.input, args.strict)
-    _add_self_nodes(root)
-    _compute_sizes(root)
-    _prune_small_nodes(root, args.minpercent)
-    sizes = _size_tree_names(root)
-    groups = _compute_tree_groups(root, sizes)
+    parser.add_argument('--format', metavar='FORMAT', default='auto',
+                        choices=['auto'] + list(INPUT_READERS.keys()),
+                        help='The format of the input files: '
+                        'auto (default) - detect from the file name and content, '
+                        'folded - flamegraph lines, '
+                        'perf - the output of "perf script", '
+                        'pprof - a (gzipped) pprof protobuf profile, '
+                        'speedscope - a speedscope JSON profile, '
+                        'cpuprofile - a Chrome .cpuprofile JSON profile')
+
+    parser.add_argument('--jobs', metavar='JOBS', default=None, type=_positive_int,
+                        help='The number of processes to use for reading multiple input files; '
+                        'default: the number of CPUs')
+
+    parser.add_argument('--diff', metavar=('BASE', 'NEW'), nargs=2,
+                        help='Generate a differential graph of the NEW flamegraph data file '
+                        'compared to the BASE flamegraph data file')
+
+    parser.add_argument('--cache', metavar='CACHE',
+                        help='A binary cache file for the parsed input data; if it is up to date, '
+                        'it is loaded instead of parsing the input file(s), otherwise it is '
+                        'written after parsing them')
+
+    parser.add_argument('--state', metavar='DIRECTORY',
+                        help='A directory holding a persistent aggregated tree, split into time '
+                        'buckets; the input file(s), if any, are added to the current bucket, '
+                        'and the graph is generated from all the (unexpired) buckets; the same '
+                        '--format and stack transform options must be given in each run')
+
+    parser.add_argument('--bucket', metavar='SECONDS', default=60, type=int,
+                        help='The duration of each time bucket of the --state; default: 60')
+
+    parser.add_argument('--expire', metavar='SECONDS', default=None, type=int,
+                        help='Remove the --state time buckets which ended more than this '
+                        'number of seconds ago; default: None (keep all buckets)')
+
+    parser.add_argument('--timed', action='store_true',
+                        help='If specified, each input line starts with a timestamp')
+
+    parser.add_argument('--timebuckets', metavar='COUNT', default=200, type=int,
+                        help='The maximal number of time buckets in the timeline of --timed '
+                        'input; default: 200')
+
+
+def _add_transform_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument('--rename', metavar=('REGEXP', 'REPLACEMENT'), nargs=2, action='append',
+                        help='Replace the matches of the regexp in each frame name (e.g., to '
+                        'merge templated names); frames renamed to an empty name are removed; '
+                        'may be repeated, applied in order')
+
+    parser.add_argument('--stripprefix', metavar='REGEXP',
+                        help='Remove the frames before the first (renamed) frame matching the '
+                        'regexp in each stack')
+
+    parser.add_argument('--include', metavar='REGEXP', action='append',
+                        help='Only keep the stacks containing a (renamed) frame matching the '
+                        'regexp; may be repeated to keep stacks matching any of them')
+
+    parser.add_argument('--exclude', metavar='REGEXP', action='append',
+                        help='Remove the stacks containing a (renamed) frame matching the '
+                        'regexp; may be repeated to remove stacks matching any of them')
+
+    parser.add_argument('--collapserecursion', action='store_true',
+                        help='If specified, collapse consecutive frames with the same (renamed) '
+                        'name in each stack into a single frame')
+
+    parser.add_argument('--maxdepth', metavar='DEPTH', type=int,
+                        help='Truncate each stack to this number of frames, attributing the '
+                        'size of deeper frames to the last kept frame')
+
+
+def _check_args(args: Namespace) -> None:
+    if args.diff is not None and args.input:
+        sys.stderr.write('flameview.py: error: can\'t specify input files together with --diff\n')
+        sys.exit(1)
+
+    if args.state is not None and (args.diff is not None or args.cache is not None):
+        sys.stderr.write('flameview.py: error: can\'t specify --state together with '
+                         '--diff or --cache\n')
+        sys.exit(1)
+
+    if args.bucket <= 0:
+        sys.stderr.write('flameview.py: error: the --bucket must be positive\n')
+        sys.exit(1)
+
+    if args.timed and (args.diff is not None or args.cache is not None
+                       or args.state is not None):
+        sys.stderr.write('flameview.py: error: can\'t specify --timed together with '
+                         '--diff, --cache or --state\n')
+        sys.exit(1)
+
+    if args.detailpercent is not None and args.detailpercent > args.minpercent:
+        sys.stderr.write('flameview.py: error: the --detailpercent must not be larger than '
+                         'the --minpercent\n')
+        sys.exit(1)
+
+    if args.maxdepth is not None and args.maxdepth <= 0:
+        sys.stderr.write('flameview.py: error: the --maxdepth must be positive\n')
+        sys.exit(1)
+
+    if args.timebuckets <= 0:
+        sys.stderr.write('flameview.py: error: the --timebuckets must be positive\n')
+        sys.exit(1)
+
+    if args.serve is not None and (args.timed or args.compress or args.gzip
+                                   or args.output is not None):
+        sys.stderr.write('flameview.py: error: can\'t specify --serve together with '
+                         '--timed, --compress, --gzip or --output\n')
+        sys.exit(1)
+
+
+def _positive_int(text: str) -> int:
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise ArgumentTypeError('invalid positive integer value: %r' % text)
+    return value
+
+
+# Measure the wall time, CPU time and peak memory of each stage. The peak RSS is of the whole
+# process so far; the peak traced memory (if tracemalloc is tracing) is of the stage.
+class StageProfiler:
+    def __init__(self) -> None:
+        self.stages: List[Dict[str, Any]] = []
+        self._restart()
+
+    def _restart(self) -> None:
+        if tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.wall_time = time.perf_counter()
+        self.cpu_time = time.process_time()
+
+    def stage(self, name: str, root: Optional[Node], counts: Dict[str, int]) -> None:
+        stage: Dict[str, Any] = {'stage': name,
+                                 'wall_seconds': time.perf_counter() - self.wall_time,
+                                 'cpu_seconds': time.process_time() - self.cpu_time,
+                                 'peak_rss_bytes': _peak_rss_bytes()}
+        if tracemalloc.is_tracing():
+            stage['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+        if root is not None:
+            stage['nodes'] = _count_tree_nodes(root)
+        stage.update(counts)
+        self.stages.append(stage)
+        self._restart()
+
+    def report(self, path: Optional[str]) -> None:
+        if path is None:
+            for stage in self.stages:
+                sys.stderr.write('flameview.py: %s: %s\n' % (stage['stage'], ', '.join(
+                    ['%s: %s' % (key, _format_profile_value(value))
+                     for key, value in stage.items() if key != 'stage'])))
+            return
 
-    sort_key = {'name': _by_name, 'size': _by_size, 'input': _by_input}[args.sortby]
-    column_sizes = _compute_tree_column_sizes(root, sort_key)
-    rows = _compute_tree_rows(root)
+        try:
+            with open(path, 'w') as file:
+                json.dump({'version': VERSION, 'stages': self.stages}, file, indent=2)
+                file.write('\n')
+        except OSError as error:
+            sys.stderr.write('flameview.py: %s: error: %s\n' % (path, error.strerror))
+            sys.exit(1)
 
-    _print_output_data(args, groups, column_sizes, rows)
 
+def _profile_stage(profiler: Optional[StageProfiler], name: str, root: Optional[Node] = None,
+                   **counts: int) -> None:
+    if profiler is not None:
+        profiler.stage(name, root, counts)
 
-def _load_input_data(path: Optional[str], is_strict: bool) -> Node:
-    if path is None or path == '-':
-        return _load_data_file('stdin', is_strict, sys.stdin)
-    with open(path, 'r') as file:
-        return _load_data_file(path, is_strict, file)
 
+def _peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
 
-def _load_data_file(path: str, is_strict: bool, file: TextIO) -> Node:
-    line_regexp = re.compile(r'''
-        \A
-        (.*?)
-        (?:
-            \s+
-            ([+]?\d*\.?\d+(?:[eE][-+]?\d+)?)
-            (?:
-                \s+
-                ([+-]?\d*\.?\d+(?:[eE][-+]?\d+)?)
-            )?
-        )?
+
+def _format_profile_value(value: Any) -> str:
+    if isinstance(value, float):
+        return '%.3f' % value
+    return str(value)
+
+
+def _count_tree_nodes(root: Node) -> int:
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.nodes.values())
+    return count
+
+
+def _load_root(args: Namespace, transform: Optional['StackTransform']) -> Node:
+    if args.state is not None:
+        return _load_state_data(args, transform)
+
+    cache_key = None if args.cache is None \
+        else _cache_key(args.input, args.diff, args.format, transform)
+    root = None if cache_key is None else _load_cache_file(args.cache, cache_key)
+    if root is None:
+        if args.diff is None:
+            root = _load_input_data(args.input, args.strict, args.format, transform, args.jobs)
+        else:
+            root = _load_diff_data(args.diff[0], args.diff[1], args.strict, args.format,
+                                   transform)
+        if cache_key is not None:
+            _save_cache_file(args.cache, cache_key, root)
+    return root
+
+
+INPUT_BUFFER_SIZE = 1 << 20
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _load_input_data(paths: List[str], is_strict: bool, input_format: str,
+                     transform: Optional['StackTransform'], jobs: Optional[int]) -> Node:
+    paths = _expand_input_paths(paths)
+    if len(paths) == 1:
+        with _open_input_file(paths[0]) as file:
+            return _load_data_file(_input_name(paths[0]), is_strict, input_format, transform, file)
+
+    if '-' in paths:
+        sys.stderr.write('flameview.py: error: can\'t read standard input '
+                         'together with other input files\n')
+        sys.exit(1)
+
+    root = Node('all')
+    with ProcessPoolExecutor(jobs) as executor:
+        for table in executor.map(_load_input_table, paths, repeat(is_strict),
+                                  repeat(input_format), repeat(transform)):
+            _add_table(root, table)
+    return root
+
+
+def _load_diff_data(base_path: str, new_path: str, is_strict: bool, input_format: str,
+                    transform: Optional['StackTransform']) -> Node:
+    root = Node('all')
+
+    with _open_input_file(base_path) as file:
+        for _timestamp, names, size, _difference, tooltip_html \
+                in _read_data_file(_input_name(base_path), is_strict, input_format, transform,
+                                   file):
+            _add_node(names, root, None if size is None else 0.0, tooltip_html,
+                      None if size is None else -size)
+
+    with _open_input_file(new_path) as file:
+        for _timestamp, names, size, _difference, tooltip_html \
+                in _read_data_file(_input_name(new_path), is_strict, input_format, transform, file):
+            _add_node(names, root, size, tooltip_html, size)
+
+    return root
+
+
+def _expand_input_paths(paths: List[str]) -> List[str]:
+    expanded_paths: List[str] = []
+    for path in paths or ['-']:
+        if path != '-' and any(char in path for char in '*?['):
+            expanded_paths += sorted(glob(path)) or [path]
+        else:
+            expanded_paths.append(path)
+    return expanded_paths
+
+
+def _input_name(path: str) -> str:
+    return 'stdin' if path == '-' else path
+
+
+@contextmanager
+def _open_input_file(path: str) -> Iterator[TextIO]:
+    if path == '-':
+        binary_file = open(sys.stdin.fileno(), 'rb', buffering=INPUT_BUFFER_SIZE, closefd=False)
+    else:
+        binary_file = open(path, 'rb', buffering=INPUT_BUFFER_SIZE)
+    with binary_file, _open_text_file(_input_name(path), binary_file) as file:
+        yield file
+
+
+def _open_text_file(path: str, binary_file: BinaryIO) -> TextIO:
+    magic = binary_file.peek(len(ZSTD_MAGIC))  # type: ignore
+    if magic.startswith(GZIP_MAGIC):
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=binary_file, mode='rb'))
+    if magic.startswith(ZSTD_MAGIC):
+        return io.TextIOWrapper(_open_zstd_file(path, binary_file))
+    return io.TextIOWrapper(binary_file)
+
+
+def _open_zstd_file(path: str, binary_file: BinaryIO) -> BinaryIO:
+    try:
+        import zstandard  # type: ignore # pylint: disable=import-outside-toplevel
+    except ImportError:
+        sys.stderr.write('flameview.py: %s: error: reading zstd compressed input '
+                         'requires the zstandard module\n' % path)
+        sys.exit(1)
+    decompressor = zstandard.ZstdDecompressor()
+    # Buffered, so the input format can be detected by peeking at the decompressed data.
+    return io.BufferedReader(decompressor.stream_reader(binary_file, read_size=INPUT_BUFFER_SIZE),
+                             INPUT_BUFFER_SIZE)
+
+
+LINE_REGEXP = re.compile(r'''
+    \A
+    (.*?)
+    (?:
+        \s+
+        ([+]?\d*\.?\d+(?:[eE][-+]?\d+)?)
         (?:
             \s+
-            [#]
-            \s*
-            (.*?)
+            ([+-]?\d*\.?\d+(?:[eE][-+]?\d+)?)
         )?
+    )?
+    (?:
+        \s+
+        [#]
         \s*
-        \Z
-    ''', re.X)
+        (.*?)
+    )?
+    \s*
+    \Z
+''', re.X)
+
+
+def _load_data_file(path: str, is_strict: bool, input_format: str,
+                    transform: Optional['StackTransform'], file: TextIO) -> Node:
     root = Node('all')
+    for _timestamp, names, size, difference, tooltip_html \
+            in _read_data_file(path, is_strict, input_format, transform, file):
+        _add_node(names, root, size, tooltip_html, difference)
+    return root
+
+
+DataTable = Dict[Tuple[str, ...], Tuple[Optional[float], Optional[float], str]]
+
+
+def _load_input_table(path: str, is_strict: bool, input_format: str,
+                      transform: Optional['StackTransform']) -> DataTable:
+    table: DataTable = {}
+    with _open_input_file(path) as file:
+        for _timestamp, names, size, difference, tooltip_html \
+                in _read_data_file(path, is_strict, input_format, transform, file):
+            key = tuple(names)
+            previous = table.get(key)
+            if previous is not None:
+                size = _add_optional(previous[0], size)
+                difference = _add_optional(previous[1], difference)
+            table[key] = (size, difference, tooltip_html)
+    return table
+
+
+def _add_table(root: Node, table: DataTable) -> None:
+    for names, (size, difference, tooltip_html) in table.items():
+        _add_node(names, root, size, tooltip_html, difference)
+
+
+DataRecord = Tuple[Optional[float], List[str], Optional[float], Optional[float], str]
+
+
+# Read the records of an input file. The timestamp is None unless the input format provides one,
+# which for folded input requires is_timed.
+def _read_data_file(path: str, is_strict: bool,  # pylint: disable=too-many-arguments
+                    input_format: str, transform: Optional['StackTransform'], file: TextIO,
+                    is_timed: bool = False) -> Iterator[DataRecord]:
+    if input_format == 'auto':
+        input_format = _detect_input_format(path, file)
+    if input_format == 'folded' and is_timed:
+        records = _read_timed_folded_file(path, is_strict, file)
+    else:
+        records = INPUT_READERS[input_format](path, is_strict, file)
+
+    if transform is None:
+        yield from records
+        return
+
+    for timestamp, names, size, difference, tooltip_html in records:
+        transformed_names = transform(names)
+        if transformed_names is not None:
+            yield timestamp, transformed_names, size, difference, tooltip_html
+
+
+def _detect_input_format(path: str, file: TextIO) -> str:
+    lower_path = path.lower()
+    for suffixes, input_format in INPUT_SUFFIXES:
+        if lower_path.endswith(suffixes):
+            return input_format
+
+    head = file.buffer.peek(INPUT_DETECT_SIZE)[:INPUT_DETECT_SIZE]  # type: ignore
+    if _is_pprof_head(head):
+        return 'pprof'
+    text = head.decode('utf-8', 'replace')
+    if text.lstrip().startswith('{'):
+        return 'cpuprofile' if '"nodes"' in text and 'speedscope' not in text else 'speedscope'
+    if PERF_FRAME_REGEXP.search(text):
+        return 'perf'
+    return 'folded'
+
+
+# The wire types of the top level fields of a pprof profile (the comments may be packed or not).
+PPROF_FIELD_WIRE_TYPES = {
+    1: (2,), 2: (2,), 3: (2,), 4: (2,), 5: (2,), 6: (2,), 7: (0,), 8: (0,), 9: (0,), 10: (0,),
+    11: (2,), 12: (0,), 13: (0, 2), 14: (0,),
+}
+
+# The number of whole valid fields which must precede a field cut off by the end of the head of a
+# pprof profile.
+PPROF_DETECT_FIELDS_COUNT = 2
+
+
+# Whether the (decompressed) head of the data consists of valid top level fields of a pprof profile.
+# The fields may come in any order; Go CPU profiles start with the time (field 9) and Go heap
+# profiles with the period type (field 11). The first string (field 6) is always empty. A full size
+# head may end in the middle of a field; a shorter head is the whole data, so it must end with a
+# whole field.
+def _is_pprof_head(head: bytes) -> bool:
+    is_cut_valid = len(head) >= INPUT_DETECT_SIZE
+    has_strings = False
+    count = 0
+    offset = 0
+    try:
+        while offset < len(head):
+            tag, offset = _decode_varint(head, offset)
+            if tag & 7 not in PPROF_FIELD_WIRE_TYPES.get(tag >> 3, ()):
+                return False
+            value, offset = _decode_varint(head, offset)
+            if tag & 7 == 2:
+                if offset + value > len(head):
+                    return is_cut_valid and count >= PPROF_DETECT_FIELDS_COUNT
+                if tag >> 3 in (1, 11) and not _is_pprof_value_type(head[offset:offset + value]):
+                    return False
+                if tag >> 3 == 6 and not has_strings:
+                    if value > 0:
+                        return False
+                    has_strings = True
+                offset += value
+            count += 1
+    except EOFError:
+        return is_cut_valid and count >= PPROF_DETECT_FIELDS_COUNT
+    return count > 0
+
+
+# Whether the data is a valid pprof value type, which only contains its type and unit fields.
+def _is_pprof_value_type(data: bytes) -> bool:
+    try:
+        fields = _protobuf_message(data)
+    except (ValueError, EOFError):
+        return False
+    return set(fields.keys()) <= {1, 2}
+
+
+def _read_folded_file(path: str, is_strict: bool, file: TextIO) -> Iterator[DataRecord]:
     ignored = 0
-    for line_number, line_text in enumerate(file.readlines()):
-        line_number += 1
-        match = line_regexp.fullmatch(line_text)
-        if not match:
+    for line_number, line_text in enumerate(file, 1):
+        fields = _parse_line(line_text)
+        if fields is None:
             if is_strict:
                 sys.stderr.write('flameview.py: %s:%s: error: invalid line\n' % (path, line_number))
             ignored += 1
             continue
-        names_text, size_text, _difference_text, tooltip_text = match.group(1, 2, 3, 4)
+        names_text, size_text, difference_text, tooltip_text = fields
         size = None if size_text is None else float(size_text)
-        _add_node(names_text.split(';'), root, size, tooltip_text or '')
+        difference = None if difference_text is None else float(difference_text)
+        yield None, names_text.split(';'), size, difference, tooltip_text or ''
+
+    _report_ignored_lines(path, is_strict, ignored)
+
 
+def _report_ignored_lines(path: str, is_strict: bool, ignored: int, kind: str = 'lines') -> None:
     if ignored > 0:
         if is_strict:
             sys.exit(1)
-        sys.stderr.write('flameview.py: %s: warning: ignored %s invalid lines\n' % (path, ignored))
+        sys.stderr.write('flameview.py: %s: warning: ignored %s invalid %s\n'
+                         % (path, ignored, kind))
+
+
+NUMBER_REGEXP = re.compile(r'[+-]?\d*\.?\d+(?:[eE][-+]?\d+)?')
+
+ASCII_DIGITS = frozenset('0123456789')
+
+LineFields = Tuple[str, Optional[str], Optional[str], Optional[str]]
+
+
+# Same as matching LINE_REGEXP, without its backtracking. The rare ambiguous lines (a "#" not
+# preceded by white space, or an embedded line break) fall back to the regexp.
+def _parse_line(line_text: str) -> Optional[LineFields]:
+    text = line_text.rstrip()
+    hash_index = text.find('#')
+    if (hash_index >= 0 and (hash_index == 0 or not text[hash_index - 1].isspace())) \
+            or '\n' in text:
+        match = LINE_REGEXP.fullmatch(line_text)
+        return None if match is None else cast(LineFields, match.group(1, 2, 3, 4))
+
+    tooltip_text: Optional[str] = None
+    if hash_index >= 0:
+        tooltip_text = text[hash_index + 1:].lstrip()
+        text = text[:hash_index].rstrip()
+
+    names_text, last_text = _split_last_field(text)
+    if last_text is None or not _is_number(last_text):
+        return text, None, None, tooltip_text
+
+    prefix_text, before_last_text = _split_last_field(names_text)
+    if before_last_text is not None \
+            and before_last_text[0] != '-' and _is_number(before_last_text):
+        return prefix_text, before_last_text, last_text, tooltip_text
+
+    if last_text[0] == '-':
+        return text, None, None, tooltip_text
+
+    return names_text, last_text, None, tooltip_text
+
+
+def _split_last_field(text: str) -> Tuple[str, Optional[str]]:
+    parts = text.rsplit(None, 1)
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    if text and text[0].isspace():
+        return '', parts[0]
+    return text, None
+
+
+def _is_number(text: str) -> bool:
+    return (text.isdigit() and ASCII_DIGITS.issuperset(text)) \
+        or NUMBER_REGEXP.fullmatch(text) is not None
+
+
+INPUT_DETECT_SIZE = 4096
+
+INPUT_SUFFIXES = [
+    (('.pb.gz', '.pb', '.pprof'), 'pprof'),
+    (('.cpuprofile',), 'cpuprofile'),
+    (('.speedscope.json',), 'speedscope'),
+]
+
+PERF_HEADER_REGEXP = re.compile(r'(\S.*?)\s+-?\d+(?:/-?\d+)?\s')
+
+PERF_TIMESTAMP_REGEXP = re.compile(r'\s(\d+\.\d+):(?:\s|$)')
+
+PERF_FRAME_REGEXP = re.compile(r'^[ \t]+[0-9a-fA-F]+ ', re.MULTILINE)
+
+PERF_SYMBOL_REGEXP = re.compile(r'\s+[0-9a-fA-F]+\s+(.*?)(?:\+0x[0-9a-fA-F]+)?(?:\s+\((.*)\))?')
+
+
+# Read the samples of the output of "perf script". Each sample is a header line starting with the
+# command name (and possibly a timestamp), followed by indented frame lines from the leaf to the
+# root. Each sample has a size of 1, and its stack starts with the command name.
+def _read_perf_file(path: str, is_strict: bool, file: TextIO) -> Iterator[DataRecord]:
+    ignored = 0
+    frame_names: Dict[str, str] = {}
+    names: Optional[List[str]] = None
+    timestamp: Optional[float] = None
+    for line_number, line_text in enumerate(file, 1):
+        text = line_text.rstrip()
+        if text and text[0].isspace():
+            if names is not None:
+                name = frame_names.get(text)
+                if name is None:
+                    name = frame_names[text] = _perf_frame_name(text)
+                if name:
+                    names.append(name)
+                    continue
+        elif names is not None:
+            yield timestamp, [names[0]] + names[:0:-1], 1.0, None, ''
+            names = None
+
+        if not text or text[0] == '#':
+            continue
+
+        match = PERF_HEADER_REGEXP.match(text) if names is None else None
+        if match is None:
+            if is_strict:
+                sys.stderr.write('flameview.py: %s:%s: error: invalid line\n' % (path, line_number))
+            ignored += 1
+            continue
+        names = [intern(match.group(1))]
+        match = PERF_TIMESTAMP_REGEXP.search(text, match.end() - 1)
+        timestamp = None if match is None else float(match.group(1))
+
+    if names is not None:
+        yield timestamp, [names[0]] + names[:0:-1], 1.0, None, ''
+
+    _report_ignored_lines(path, is_strict, ignored)
+
+
+def _perf_frame_name(text: str) -> str:
+    match = PERF_SYMBOL_REGEXP.fullmatch(text)
+    if match is None:
+        return ''
+    symbol, dso = match.group(1, 2)
+    if symbol == '[unknown]' and dso:
+        symbol = '[%s]' % os.path.basename(dso)
+    return intern(symbol)
+
+
+# Read the samples of a pprof protobuf profile. The top level fields are streamed, so only the
+# aggregated samples and the tables are held in memory.
+def _read_pprof_file(path: str, is_strict: bool, file: TextIO) -> Iterator[DataRecord]:
+    profile = PprofProfile()
+    try:
+        for field, value in _protobuf_stream_fields(file.buffer):  # type: ignore
+            profile.add_field(field, value)
+    except (ValueError, TypeError, EOFError):
+        sys.stderr.write('flameview.py: %s: error: invalid pprof profile\n' % path)
+        sys.exit(1)
+
+    value_index = profile.value_index()
+    ignored = 0
+    for key, values in profile.samples.items():
+        if value_index < 0 or value_index >= len(values) or values[value_index] == 0:
+            continue
+        try:
+            names = profile.stack_names(key)
+        except KeyError as error:
+            if is_strict:
+                sys.stderr.write('flameview.py: %s: error: sample with an invalid location: %s\n'
+                                 % (path, error.args[0]))
+            ignored += 1
+            continue
+        yield None, names, float(values[value_index]), None, ''
+
+    _report_ignored_lines(path, is_strict, ignored, 'samples')
+
+
+# The tables of a pprof profile. Samples are aggregated by their (usually packed) location ids
+# bytes, which are only decoded once for each distinct stack. The function names of each location
+# are interned once, with the functions inlined into the location as separate frames.
+class PprofProfile:
+
+    def __init__(self) -> None:
+        self.value_types: List[int] = []
+        self.default_type = 0
+        self.samples: Dict[Any, List[int]] = {}
+        self.locations: Dict[int, Tuple[int, List[int]]] = {}
+        self.functions: Dict[int, int] = {}
+        self.strings: List[str] = []
+        self.locations_names: Dict[int, Optional[List[str]]] = {}
+
+    def add_field(self, field: int, value: Any) -> None:
+        if field == 1:
+            self.value_types.append(_protobuf_message(value).get(1, [0])[-1])
+        elif field == 2:
+            self._add_sample(value)
+        elif field == 4:
+            location = _protobuf_message(value)
+            function_ids = [_protobuf_message(line).get(1, [0])[-1]
+                            for line in location.get(4, [])]
+            self.locations[location.get(1, [0])[-1]] = (location.get(3, [0])[-1], function_ids)
+        elif field == 5:
+            function = _protobuf_message(value)
+            self.functions[function.get(1, [0])[-1]] = function.get(2, [0])[-1]
+        elif field == 6:
+            self.strings.append(bytes(value).decode('utf-8', 'replace'))
+        elif field == 14:
+            self.default_type = value
+
+    def _add_sample(self, data: bytes) -> None:
+        sample = _protobuf_message(data, (2,))
+        location_ids = sample.get(1, [])
+        key = location_ids[0] if len(location_ids) == 1 \
+            and isinstance(location_ids[0], bytes) else tuple(location_ids)
+        values = [_signed_int64(number) for number in sample[2]]
+        previous = self.samples.get(key)
+        if previous is None:
+            self.samples[key] = values
+        else:
+            self.samples[key] = [old + new for old, new in zip(previous, values)]
+
+    # The index of the default sample value, or of the last one if there is no default.
+    def value_index(self) -> int:
+        if self.default_type and self.default_type in self.value_types:
+            return self.value_types.index(self.default_type)
+        return len(self.value_types) - 1
+
+    # The frame names of a sample from the root to the leaf. Raises a KeyError with the id of the
+    # first location which refers to a missing location, function or string.
+    def stack_names(self, key: Any) -> List[str]:
+        names: List[str] = []
+        for location_id in reversed(_decode_varints(key) if isinstance(key, bytes) else key):
+            if location_id not in self.locations_names:
+                self.locations_names[location_id] = self._location_names(location_id)
+            location_names = self.locations_names[location_id]
+            if location_names is None:
+                raise KeyError(location_id)
+            names += location_names
+        return names
+
+    def _location_names(self, location_id: int) -> Optional[List[str]]:
+        location = self.locations.get(location_id)
+        if location is None:
+            return None
+        address, function_ids = location
+        names: List[str] = []
+        for function_id in reversed(function_ids):
+            string_index = self.functions.get(function_id)
+            if string_index is None or string_index >= len(self.strings):
+                return None
+            names.append(intern(self.strings[string_index]))
+        return names or [intern('0x%x' % address)]
+
+
+PROTOBUF_FIELD_HEADER_SIZE = 32
+
+
+# Stream the (number, value) top level fields of a protobuf message. The value is an integer for
+# numeric fields, and bytes for length delimited fields. Each chunk read always contains a whole
+# field header; the rest of a length delimited field larger than the chunk is read at once.
+def _protobuf_stream_fields(file: BinaryIO) -> Iterator[Tuple[int, Any]]:
+    data = b''
+    offset = 0
+    while True:
+        if len(data) - offset < PROTOBUF_FIELD_HEADER_SIZE:
+            data = data[offset:] + file.read(INPUT_BUFFER_SIZE)
+            offset = 0
+            if not data:
+                return
+        tag, offset = _decode_varint(data, offset)
+        wire_type = tag & 7
+        if wire_type == 0:
+            number, offset = _decode_varint(data, offset)
+            yield tag >> 3, number
+        elif wire_type == 2:
+            size, offset = _decode_varint(data, offset)
+            end = offset + size
+            if end <= len(data):
+                chunk = data[offset:end]
+                offset = end
+            else:
+                chunk = data[offset:] + file.read(end - len(data))
+                if len(chunk) != size:
+                    raise EOFError()
+                data = b''
+                offset = 0
+            yield tag >> 3, chunk
+        elif wire_type in (1, 5):
+            end = offset + (8 if wire_type == 1 else 4)
+            if end > len(data):
+                raise EOFError()
+            yield tag >> 3, int.from_bytes(data[offset:end], 'little')
+            offset = end
+        else:
+            raise ValueError('invalid wire type')
+
+
+# Decode the list of values of each field number of a nested protobuf message. The repeated integer
+# fields listed in packed may be either packed or not, and are expanded in both cases.
+def _protobuf_message(data: bytes, packed: Tuple[int, ...] = ()) -> Dict[int, List[Any]]:
+    fields: Dict[int, List[Any]] = {}
+    offset = 0
+    while offset < len(data):
+        tag, offset = _decode_varint(data, offset)
+        wire_type = tag & 7
+        values = fields.setdefault(tag >> 3, [])
+        if wire_type == 0:
+            value, offset = _decode_varint(data, offset)
+            values.append(value)
+        elif wire_type == 2:
+            size, offset = _decode_varint(data, offset)
+            if offset + size > len(data):
+                raise EOFError()
+            values.append(data[offset:offset + size])
+            offset += size
+        elif wire_type in (1, 5):
+            size = 8 if wire_type == 1 else 4
+            if offset + size > len(data):
+                raise EOFError()
+            values.append(int.from_bytes(data[offset:offset + size], 'little'))
+            offset += size
+        else:
+            raise ValueError('invalid wire type')
+
+    for number in packed:
+        fields[number] = _unpack_varints(fields.get(number, []))
+    return fields
+
+
+def _unpack_varints(values: List[Any]) -> List[Any]:
+    if not any(isinstance(value, bytes) for value in values):
+        return values
+    unpacked: List[Any] = []
+    for value in values:
+        if isinstance(value, bytes):
+            unpacked += _decode_varints(value)
+        else:
+            unpacked.append(value)
+    return unpacked
+
+
+def _decode_varints(data: bytes) -> List[int]:
+    values: List[int] = []
+    value = 0
+    shift = 0
+    for byte in data:
+        if byte < 0x80:
+            values.append(value | (byte << shift))
+            value = 0
+            shift = 0
+        else:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+    if shift > 0:
+        raise EOFError()
+    return values
+
+
+def _decode_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise EOFError()
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _signed_int64(value: int) -> int:
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+SPEEDSCOPE_UNIT_SECONDS = {'nanoseconds': 1e-9, 'microseconds': 1e-6, 'milliseconds': 1e-3,
+                           'seconds': 1.0}
+
+
+# Read the samples of a speedscope JSON profile. If the file contains several profiles, each stack
+# starts with the name of its profile. Samples and events referring to a missing frame are ignored.
+def _read_speedscope_file(path: str, is_strict: bool, file: TextIO) -> Iterator[DataRecord]:
+    data = _load_json_profile(path, file)
+    ignored = 0
+    try:
+        frame_names = [intern(frame['name']) for frame in data['shared']['frames']]
+        profiles = data['profiles']
+        for profile in profiles:
+            prefix = [intern(profile.get('name') or 'profile')] if len(profiles) > 1 else []
+            if profile['type'] == 'sampled':
+                ignored += yield from _read_speedscope_samples(path, is_strict, profile,
+                                                               frame_names, prefix)
+            else:
+                ignored += yield from _read_speedscope_events(path, is_strict, profile,
+                                                              frame_names, prefix)
+    except (KeyError, TypeError):
+        _invalid_json_profile(path)
+
+    _report_ignored_lines(path, is_strict, ignored, 'samples and events')
+
+
+# Read the weighted stacks of a sampled speedscope profile, and return the number of ignored ones.
+def _read_speedscope_samples(path: str, is_strict: bool, profile: Any, frame_names: List[str],
+                             prefix: List[str]) -> Generator[DataRecord, None, int]:
+    ignored = 0
+    frame_indices = range(len(frame_names))
+    for stack, weight in zip(profile['samples'], profile.get('weights') or repeat(1)):
+        if all(index in frame_indices for index in stack):
+            yield None, prefix + [frame_names[index] for index in stack], float(weight), None, ''
+            continue
+        if is_strict:
+            sys.stderr.write('flameview.py: %s: error: sample with an invalid frame\n' % path)
+        ignored += 1
+    return ignored
+
+
+# Read the stacks between each two consecutive frame open and close events of an evented speedscope
+# profile, with their timestamp and duration, and return the number of ignored events.
+def _read_speedscope_events(path: str, is_strict: bool, profile: Any, frame_names: List[str],
+                            prefix: List[str]) -> Generator[DataRecord, None, int]:
+    ignored = 0
+    frame_indices = range(len(frame_names))
+    scale = SPEEDSCOPE_UNIT_SECONDS.get(profile.get('unit'))
+    names = prefix
+    previous_at = profile.get('startValue', 0)
+    for event in profile['events']:
+        at = event['at']
+        if at > previous_at and len(names) > len(prefix):
+            yield None if scale is None else previous_at * scale, names, \
+                float(at - previous_at), None, ''
+        previous_at = at
+        if event['frame'] not in frame_indices:
+            if is_strict:
+                sys.stderr.write('flameview.py: %s: error: event with an invalid frame\n' % path)
+            ignored += 1
+        elif event['type'] == 'O':
+            names = names + [frame_names[event['frame']]]
+        elif len(names) > len(prefix):
+            names = names[:-1]
+    return ignored
+
+
+# Read the samples of a Chrome ".cpuprofile" JSON profile. Each sample has a size of 1, and the
+# timestamp of its time delta from the start of the profile. The stack of each node is computed
+# once, from its parent's stack. Samples referring to a missing node are ignored.
+def _read_cpuprofile_file(path: str, is_strict: bool, file: TextIO) -> Iterator[DataRecord]:
+    data = _load_json_profile(path, file)
+    ignored = 0
+    try:
+        nodes = {node['id']: node for node in data['nodes']}
+        parents: Dict[int, int] = {}
+        for node in nodes.values():
+            if 'parent' in node:
+                parents[node['id']] = node['parent']
+            for child_id in node.get('children', []):
+                parents[child_id] = node['id']
+
+        node_names: Dict[int, List[str]] = {}
+        timestamp = data.get('startTime', 0)
+        for node_id, time_delta in zip(data['samples'], data.get('timeDeltas') or repeat(0)):
+            timestamp += time_delta
+            if node_id not in nodes:
+                if is_strict:
+                    sys.stderr.write('flameview.py: %s: error: sample with an invalid node: %s\n'
+                                     % (path, node_id))
+                ignored += 1
+                continue
+            names = node_names.get(node_id)
+            if names is None:
+                names = _cpuprofile_node_names(node_id, nodes, parents, node_names)
+            yield timestamp / 1e6, names, 1.0, None, ''
+    except (KeyError, TypeError):
+        _invalid_json_profile(path)
+
+    _report_ignored_lines(path, is_strict, ignored, 'samples')
+
+
+def _cpuprofile_node_names(node_id: int, nodes: Dict[int, Any], parents: Dict[int, int],
+                           node_names: Dict[int, List[str]]) -> List[str]:
+    path_ids: List[int] = []
+    names: Optional[List[str]] = None
+    while names is None:
+        path_ids.append(node_id)
+        if node_id not in parents:
+            names = []
+        else:
+            node_id = parents[node_id]
+            names = node_names.get(node_id)
+
+    for path_id in reversed(path_ids):
+        name = nodes[path_id]['callFrame']['functionName'] or '(anonymous)'
+        if name != '(root)':
+            names = names + [intern(name)]
+        node_names[path_id] = names
+    return names
+
+
+def _load_json_profile(path: str, file: TextIO) -> Any:
+    try:
+        return json.load(file)
+    except ValueError as error:
+        sys.stderr.write('flameview.py: %s: error: invalid JSON: %s\n' % (path, error))
+        sys.exit(1)
+
+
+def _invalid_json_profile(path: str) -> None:
+    sys.stderr.write('flameview.py: %s: error: invalid profile\n' % path)
+    sys.exit(1)
+
+
+INPUT_READERS: Dict[str, Callable[[str, bool, TextIO], Iterator[DataRecord]]] = {
+    'folded': _read_folded_file,
+    'perf': _read_perf_file,
+    'pprof': _read_pprof_file,
+    'speedscope': _read_speedscope_file,
+    'cpuprofile': _read_cpuprofile_file,
+}
+
+
+def _stack_transform(args: Namespace) -> Optional['StackTransform']:
+    if not (args.rename or args.stripprefix is not None or args.include or args.exclude
+            or args.collapserecursion or args.maxdepth is not None):
+        return None
+    try:
+        return StackTransform(args)
+    except re.error as error:
+        sys.stderr.write('flameview.py: error: invalid regexp: %r: %s\n' % (error.pattern, error))
+        sys.exit(1)
+
+
+# Rename, strip, filter, collapse and truncate the frames of each stack.
+class StackTransform:
+    def __init__(self, args: Namespace) -> None:
+        renames = args.rename or []
+        self.rules = {'renames': renames, 'strip_prefix': args.stripprefix,
+                      'includes': args.include or [], 'excludes': args.exclude or [],
+                      'is_collapse_recursion': args.collapserecursion,
+                      'max_depth': args.maxdepth}
+        self.renames = [(re.compile(pattern), replacement) for pattern, replacement in renames]
+        self.strip_prefix = None if args.stripprefix is None else re.compile(args.stripprefix)
+        self.includes = [re.compile(pattern) for pattern in args.include or []]
+        self.excludes = [re.compile(pattern) for pattern in args.exclude or []]
+        self.is_collapse_recursion = args.collapserecursion
+        self.max_depth = args.maxdepth
+        # The new name of each distinct frame, and whether it matches the strip prefix, any of the
+        # includes, and any of the excludes.
+        self.frames: Dict[str, Tuple[str, bool, bool, bool]] = {}
+
+    def __call__(self, names: List[str]) -> Optional[List[str]]:
+        frames = []
+        for name in names:
+            frame = self.frames.get(name)
+            if frame is None:
+                frame = self.frames[name] = self._transform_frame(name)
+            if frame[0]:
+                frames.append(frame)
+
+        if self.strip_prefix is not None:
+            for index, (_name, is_strip, _is_included, _is_excluded) in enumerate(frames):
+                if is_strip:
+                    del frames[:index]
+                    break
+
+        if self.includes and not any(frame[2] for frame in frames):
+            return None
+        if self.excludes and any(frame[3] for frame in frames):
+            return None
+
+        names = [frame[0] for frame in frames]
+        if self.is_collapse_recursion:
+            names = [name for index, name in enumerate(names)
+                     if index == 0 or name != names[index - 1]]
+        if self.max_depth is not None:
+            del names[self.max_depth:]
+
+        return names or None
+
+    def _transform_frame(self, name: str) -> Tuple[str, bool, bool, bool]:
+        for pattern, replacement in self.renames:
+            name = pattern.sub(replacement, name)
+        name = intern(name)
+        return (name,
+                self.strip_prefix is not None and self.strip_prefix.search(name) is not None,
+                any(pattern.search(name) is not None for pattern in self.includes),
+                any(pattern.search(name) is not None for pattern in self.excludes))
+
+
+def _add_node(names: Iterable[str], parent: Node, size: Optional[float], tooltip_html: str,
+              difference: Optional[float] = None) -> Node:
+    for name in names:
+        name_node = parent.nodes.get(name)
+        if name_node is None:
+            name = intern(name)
+            name_node = parent.nodes[name] = Node(name)
+        parent = name_node
+
+    parent.size = _add_optional(parent.size, size)
+    parent.difference = _add_optional(parent.difference, difference)
+    parent.tooltip_html = tooltip_html
+    return parent
+
+
+def _add_optional(total: Optional[float], value: Optional[float]) -> Optional[float]:
+    if value is None:
+        return total
+    if total is None:
+        return value
+    return total + value
+
+
+CACHE_MAGIC = b'FVCACHE1'
+
+CACHE_ALIGNMENT = 8
+
+CacheKey = Dict[str, Any]
+
+
+def _cache_key(paths: List[str], diff_paths: Optional[List[str]], input_format: str,
+               transform: Optional['StackTransform']) -> Optional[CacheKey]:
+    if diff_paths is None:
+        paths = _expand_input_paths(paths)
+    else:
+        paths = diff_paths
+    if '-' in paths:
+        sys.stderr.write('flameview.py: warning: can\'t cache data read from standard input\n')
+        return None
+
+    inputs: List[Tuple[str, int, int]] = []
+    for path in paths:
+        stat = os.stat(path)
+        inputs.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+    return {'version': VERSION, 'byteorder': sys.byteorder, 'diff': diff_paths is not None,
+            'inputs': inputs, 'format': input_format,
+            'transform': None if transform is None else transform.rules}
+
+
+def _load_cache_file(path: str, key: CacheKey) -> Optional[Node]:
+    try:
+        with open(path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _load_cache_data(key, data)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _load_cache_data(key: CacheKey, data: mmap.mmap) -> Optional[Node]:
+    if data[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+        return None
+    header_size = struct.unpack_from('=Q', data, len(CACHE_MAGIC))[0]
+    offset = len(CACHE_MAGIC) + 8
+    header = json.loads(data[offset:offset + header_size].decode('utf-8'))
+    if not isinstance(header, dict) or header.get('key') != json.loads(json.dumps(key)):
+        return None
+    layout = _cache_layout(header.get('sections'), _align_cache_offset(offset + header_size),
+                           len(data))
+    if layout is None:
+        return None
+
+    with memoryview(data) as view:
+        sections: List[memoryview] = [view[offset:offset + size].cast(cast(Any, type_code))
+                                      for type_code, offset, size in layout]
+        try:
+            return _load_cache_tree(sections)
+        finally:
+            for section in sections:
+                section.release()
+
+
+# The type codes of the parents, name ids, tooltip ids, sizes, differences, names ends, names data,
+# tooltips ends and tooltips data sections.
+CACHE_SECTION_TYPES = ('i', 'i', 'i', 'd', 'd', 'q', 'B', 'q', 'B')
+
+
+def _cache_layout(sections: Any, offset: int,
+                  data_size: int) -> Optional[List[Tuple[str, int, int]]]:
+    if not isinstance(sections, list) or len(sections) != len(CACHE_SECTION_TYPES):
+        return None
+
+    layout: List[Tuple[str, int, int]] = []
+    for section, type_code in zip(sections, CACHE_SECTION_TYPES):
+        if not isinstance(section, list) or len(section) != 2:
+            return None
+        section_type, count = section
+        if section_type != type_code or not isinstance(count, int) or count < 0:
+            return None
+        size = count * struct.calcsize(type_code)
+        if offset + size > data_size:
+            return None
+        layout.append((type_code, offset, size))
+        offset = _align_cache_offset(offset + size)
+    return layout
+
+
+def _load_cache_tree(sections: List[memoryview]) -> Optional[Node]:
+    parents, name_ids, tooltip_ids, sizes, differences = sections[:5]
+    names = [intern(text) for text in _load_cache_strings(sections[5], sections[6])]
+    tooltips = _load_cache_strings(sections[7], sections[8])
+    if not _is_valid_cache_tree(sections, len(names), len(tooltips)):
+        return None
+
+    nodes: List[Node] = []
+    for parent_index, name_id, tooltip_id, size, difference \
+            in zip(parents, name_ids, tooltip_ids, sizes, differences):
+        node = Node(names[name_id], None if math.isnan(size) else size, tooltips[tooltip_id],
+                    None if math.isnan(difference) else difference)
+        if parent_index >= 0:
+            nodes[parent_index].nodes[node.name] = node
+        nodes.append(node)
+    return nodes[0]
+
+
+def _is_valid_cache_tree(sections: List[memoryview], names_count: int, tooltips_count: int) -> bool:
+    parents, name_ids, tooltip_ids, sizes, differences = sections[:5]
+    # The root comes first, and each node comes after its parent.
+    return len(parents) > 0 \
+        and len(name_ids) == len(tooltip_ids) == len(sizes) == len(differences) == len(parents) \
+        and 0 <= min(name_ids) and max(name_ids) < names_count \
+        and 0 <= min(tooltip_ids) and max(tooltip_ids) < tooltips_count \
+        and parents[0] == -1 \
+        and all(0 <= parent < index for index, parent in enumerate(parents[1:], 1))
+
+
+def _load_cache_strings(ends: memoryview, data: memoryview) -> List[str]:
+    strings: List[str] = []
+    start = 0
+    for end in ends:
+        strings.append(str(data[start:end], 'utf-8'))
+        start = end
+    return strings
+
+
+def _save_cache_file(path: str, key: CacheKey, root: Node) -> None:
+    sections = _cache_sections(root)
+    header = json.dumps({'key': key, 'sections': [(section.typecode, len(section))
+                                                  for section in sections]}).encode('utf-8')
+
+    temp_path = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(CACHE_MAGIC)
+            file.write(struct.pack('=Q', len(header)))
+            file.write(header)
+            _pad_cache_file(file)
+            for section in sections:
+                section.tofile(file)  # type: ignore
+                _pad_cache_file(file)
+        os.replace(temp_path, path)
+    except OSError as error:
+        sys.stderr.write('flameview.py: %s: warning: failed to write cache: %s\n'
+                         % (path, error.strerror))
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _cache_sections(root: Node) -> List[array]:
+    nan = float('nan')
+    parents = array('i')
+    name_ids = array('i')
+    tooltip_ids = array('i')
+    sizes = array('d')
+    differences = array('d')
+    names: Dict[str, int] = {}
+    tooltips: Dict[str, int] = {}
+    positions: Dict[int, int] = {}
+
+    for parent, node in _collect_cache_nodes(root):
+        positions[node.index] = len(parents)
+        parents.append(-1 if parent is None else positions[parent.index])
+        name_ids.append(names.setdefault(node.name, len(names)))
+        tooltip_ids.append(tooltips.setdefault(node.tooltip_html, len(tooltips)))
+        sizes.append(nan if node.size is None else node.size)
+        differences.append(nan if node.difference is None else node.difference)
+
+    sections: List[array] = [parents, name_ids, tooltip_ids, sizes, differences]
+    return sections + _save_cache_strings(names) + _save_cache_strings(tooltips)
+
+
+def _collect_cache_nodes(root: Node) -> List[Tuple[Optional[Node], Node]]:
+    entries: List[Tuple[Optional[Node], Node]] = [(None, root)]
+    stack = [root]
+    while stack:
+        parent = stack.pop()
+        for node in parent.nodes.values():
+            entries.append((parent, node))
+            stack.append(node)
+    entries.sort(key=lambda entry: entry[1].index)
+    return entries
+
+
+def _save_cache_strings(strings: Dict[str, int]) -> List[array]:
+    ends = array('q')
+    data = array('B')
+    for text in strings:
+        data.frombytes(text.encode('utf-8'))
+        ends.append(len(data))
+    return [ends, data]
+
+
+def _align_cache_offset(offset: int) -> int:
+    return (offset + CACHE_ALIGNMENT - 1) // CACHE_ALIGNMENT * CACHE_ALIGNMENT
+
+
+def _pad_cache_file(file: BinaryIO) -> None:
+    offset = file.tell()
+    file.write(b'\0' * (_align_cache_offset(offset) - offset))
+
+
+Timeline = Tuple[float, float, int]
+
+
+def _load_timed_data(paths: List[str], is_strict: bool, input_format: str,
+                     transform: Optional['StackTransform'],
+                     buckets_count: int) -> Tuple[Node, Timeline]:
+    paths = _expand_input_paths(paths)
+    if '-' in paths and len(paths) > 1:
+        sys.stderr.write('flameview.py: error: can\'t read standard input '
+                         'together with other input files\n')
+        sys.exit(1)
+
+    root = Node('all')
+    time_buckets = TimeBuckets(buckets_count)
+    for path in paths:
+        with _open_input_file(path) as file:
+            for timestamp, names, size, difference, tooltip_html \
+                    in _read_data_file(_input_name(path), is_strict, input_format, transform, file,
+                                       True):
+                if timestamp is None:
+                    sys.stderr.write('flameview.py: %s: error: the input has no timestamps\n'
+                                     % _input_name(path))
+                    sys.exit(1)
+                if not math.isfinite(timestamp):
+                    sys.stderr.write('flameview.py: %s: error: invalid timestamp: %s\n'
+                                     % (_input_name(path), timestamp))
+                    sys.exit(1)
+                node = _add_node(names, root, size, tooltip_html, difference)
+                if size is not None:
+                    time_buckets.add(node, timestamp, size)
+
+    return root, time_buckets.timeline()
+
+
+# Collect the sizes of the nodes in up to count equal time buckets as the samples are read.
+# Bucket zero starts at the first timestamp (earlier ones get negative buckets); when the buckets
+# span more than count, adjacent ones are merged by doubling their width.
+class TimeBuckets:
+
+    def __init__(self, count: int) -> None:
+        self.count = count
+        self.start: Optional[float] = None
+        self.end = 0.0
+        self.width = 0.0
+        self.first_bucket = 0
+        self.last_bucket = 0
+        self.nodes: List[Node] = []
+
+    def add(self, node: Node, timestamp: float, size: float) -> None:
+        if self.start is None:
+            self.start = self.end = timestamp
+        elif self.count == 1:
+            self.start = min(self.start, timestamp)
+            self.end = max(self.end, timestamp)
+        elif self.width == 0.0 and timestamp != self.start:
+            self.width = abs(timestamp - self.start) / (self.count - 1)
+
+        bucket = 0 if self.width == 0.0 else int((timestamp - self.start) // self.width)
+        if bucket < self.first_bucket or bucket > self.last_bucket:
+            self.first_bucket = min(self.first_bucket, bucket)
+            self.last_bucket = max(self.last_bucket, bucket)
+            shift = 0
+            while (self.last_bucket >> shift) - (self.first_bucket >> shift) >= self.count:
+                shift += 1
+            if shift > 0:
+                self._merge_buckets(shift)
+                bucket >>= shift
+
+        if node.time_sizes is None:
+            node.time_sizes = {}
+            self.nodes.append(node)
+        node.time_sizes[bucket] = node.time_sizes.get(bucket, 0.0) + size
+
+    def timeline(self) -> Timeline:
+        # Renumber the used buckets to start at zero.
+        if self.start is None:
+            return 0.0, 1.0, 1
+        if self.count == 1:
+            return self.start, (self.end - self.start) or 1.0, 1
+        if self.first_bucket != 0:
+            for node in self.nodes:
+                node.time_sizes = {bucket - self.first_bucket: size
+                                   for bucket, size in node.time_sizes.items()}  # type: ignore
+        return (self.start + self.first_bucket * self.width, self.width or 1.0,
+                self.last_bucket - self.first_bucket + 1)
+
+    def _merge_buckets(self, shift: int) -> None:
+        self.width *= 1 << shift
+        self.first_bucket >>= shift
+        self.last_bucket >>= shift
+        for node in self.nodes:
+            time_sizes: Dict[int, float] = {}
+            for bucket, size in node.time_sizes.items():  # type: ignore
+                bucket >>= shift
+                time_sizes[bucket] = time_sizes.get(bucket, 0.0) + size
+            node.time_sizes = time_sizes
+
+
+def _read_timed_folded_file(path: str, is_strict: bool, file: TextIO) -> Iterator[DataRecord]:
+    ignored = 0
+    for line_number, line_text in enumerate(file, 1):
+        parts = line_text.split(None, 1)
+        fields = None
+        if len(parts) == 2 and _is_number(parts[0]):
+            fields = _parse_line(parts[1])
+        if fields is None or not math.isfinite(float(parts[0])):
+            if is_strict:
+                sys.stderr.write('flameview.py: %s:%s: error: invalid line\n' % (path, line_number))
+            ignored += 1
+            continue
+        names_text, size_text, difference_text, tooltip_text = fields
+        size = None if size_text is None else float(size_text)
+        difference = None if difference_text is None else float(difference_text)
+        yield float(parts[0]), names_text.split(';'), size, difference, tooltip_text or ''
+
+    _report_ignored_lines(path, is_strict, ignored)
+
+
+def _add_time_sizes(total: Optional[Dict[int, float]],
+                    time_sizes: Optional[Dict[int, float]]) -> Optional[Dict[int, float]]:
+    if time_sizes is None:
+        return total
+    if total is None:
+        return dict(time_sizes)
+    for bucket, size in time_sizes.items():
+        total[bucket] = total.get(bucket, 0.0) + size
+    return total
+
+
+STATE_TREE_NAME = 'tree.cache'
+
+STATE_BUCKET_REGEXP = re.compile(r'bucket-(\d+)\.cache')
+
+
+# The state tree is the sum of the bucket trees; new input is added to both, and expired buckets
+# are subtracted from it, so old input is never parsed again.
+def _load_state_data(args: Namespace, transform: Optional['StackTransform']) -> Node:
+    path = args.state
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as error:
+        sys.stderr.write('flameview.py: %s: error: %s\n' % (path, error.strerror))
+        sys.exit(1)
+
+    now = time.time()
+    options = _state_options(args.format, transform)
+    buckets = _state_buckets(path)
+    tree_path = os.path.join(path, STATE_TREE_NAME)
+    root = _load_cache_file(tree_path, _state_tree_key(buckets, options))
+    if root is None:
+        root = _rebuild_state_tree(path, buckets, options)
+
+    if args.input:
+        new_root = _load_input_data(args.input, args.strict, args.format, transform, args.jobs)
+        bucket = int(now // args.bucket) * args.bucket
+        _add_state_bucket(path, bucket, options, new_root)
+        _merge_tree(root, new_root, 1)
+        if bucket not in buckets:
+            buckets.append(bucket)
+
+    if args.expire is not None:
+        for bucket in list(buckets):
+            if bucket + args.bucket <= now - args.expire:
+                _remove_state_bucket(path, bucket, options, root)
+                buckets.remove(bucket)
+        _remove_empty_nodes(root)
+
+    _save_cache_file(tree_path, _state_tree_key(buckets, options), root)
+
+    if not root.nodes:
+        sys.stderr.write('flameview.py: %s: error: no unexpired data\n' % path)
+        sys.exit(1)
 
     return root
 
 
-def _add_node(names: List[str], parent: Node, size: Optional[float], tooltip_html: str) -> None:
-    name = names[0]
-    name_node = parent.nodes.get(name)
-    if name_node is None:
-        name_node = parent.nodes[name] = Node(name)
+def _add_state_bucket(path: str, bucket: int, options: CacheKey, new_root: Node) -> None:
+    bucket_path = _state_bucket_path(path, bucket)
+    bucket_key = _state_bucket_key(bucket, options)
+    bucket_root = _load_cache_file(bucket_path, bucket_key) or Node('all')
+    _merge_tree(bucket_root, new_root, 1)
+    _save_cache_file(bucket_path, bucket_key, bucket_root)
 
-    if len(names) > 1:
-        _add_node(names[1:], name_node, size, tooltip_html)
-        return
 
-    if size is not None:
-        if name_node.size is None:
-            name_node.size = size
+def _remove_state_bucket(path: str, bucket: int, options: CacheKey, root: Node) -> None:
+    bucket_path = _state_bucket_path(path, bucket)
+    bucket_root = _load_cache_file(bucket_path, _state_bucket_key(bucket, options))
+    if bucket_root is not None:
+        _merge_tree(root, bucket_root, -1)
+    try:
+        os.remove(bucket_path)
+    except OSError as error:
+        sys.stderr.write('flameview.py: %s: warning: failed to remove expired bucket: %s\n'
+                         % (bucket_path, error.strerror))
+
+
+def _state_buckets(path: str) -> List[int]:
+    buckets: List[int] = []
+    for name in os.listdir(path):
+        match = STATE_BUCKET_REGEXP.fullmatch(name)
+        if match is not None:
+            buckets.append(int(match.group(1)))
+    buckets.sort()
+    return buckets
+
+
+def _state_bucket_path(path: str, bucket: int) -> str:
+    return os.path.join(path, 'bucket-%s.cache' % bucket)
+
+
+def _state_options(input_format: str, transform: Optional['StackTransform']) -> CacheKey:
+    return {'format': input_format,
+            'transform': None if transform is None else transform.rules}
+
+
+def _state_bucket_key(bucket: int, options: CacheKey) -> CacheKey:
+    return {'version': VERSION, 'byteorder': sys.byteorder, 'bucket': bucket, 'options': options}
+
+
+def _state_tree_key(buckets: List[int], options: CacheKey) -> CacheKey:
+    return {'version': VERSION, 'byteorder': sys.byteorder, 'buckets': sorted(buckets),
+            'options': options}
+
+
+def _rebuild_state_tree(path: str, buckets: List[int], options: CacheKey) -> Node:
+    root = Node('all')
+    for bucket in buckets:
+        bucket_path = _state_bucket_path(path, bucket)
+        bucket_root = _load_cache_file(bucket_path, _state_bucket_key(bucket, options))
+        if bucket_root is None:
+            sys.stderr.write('flameview.py: %s: warning: ignored a bucket which is invalid, or was '
+                             'read with different input options\n' % bucket_path)
         else:
-            name_node.size += size
+            _merge_tree(root, bucket_root, 1)
+    return root
+
+
+STATE_EPSILON = 1e-9
+
+
+def _merge_tree(target_root: Node, source_root: Node, sign: float) -> None:
+    stack = [(target_root, source_root)]
+    while stack:
+        target, source = stack.pop()
+        if source.size is not None:
+            target.size = _merge_value(target.size, sign * source.size)
+        if source.difference is not None:
+            target.difference = _merge_value(target.difference, sign * source.difference)
+        if sign > 0 and source.tooltip_html:
+            target.tooltip_html = source.tooltip_html
+        for name, source_node in source.nodes.items():
+            target_node = target.nodes.get(name)
+            if target_node is None:
+                if sign < 0:
+                    continue
+                target_node = target.nodes[name] = Node(name)
+            stack.append((target_node, source_node))
+
+
+# Snap the rounding residue of cancelling totals to zero, so the emptied nodes are removed.
+def _merge_value(total: Optional[float], value: float) -> float:
+    if total is None:
+        return value
+    merged = total + value
+    if abs(merged) <= STATE_EPSILON * max(abs(total), abs(value)):
+        return 0.0
+    return merged
+
+
+def _remove_empty_nodes(root: Node) -> None:
+    stack = [(root, iter(list(root.nodes.values())))]
+    while stack:
+        parent, nodes = stack[-1]
+        node = next(nodes, None)
+        if node is not None:
+            stack.append((node, iter(list(node.nodes.values()))))
+            continue
+
+        stack.pop()
+        if parent.size == 0:
+            parent.size = None
+        if parent.difference == 0:
+            parent.difference = None
+        if stack and not parent.nodes and parent.size is None and parent.difference is None:
+            del stack[-1][0].nodes[parent.name]
+
+
+# Build the tree of the reversed stacks, rooted at the nodes with a (self) size. Tooltips are
+# omitted, as each reversed node combines many stacks.
+def _reverse_tree(root: Node) -> Node:
+    reversed_root = Node('all')
+    reversed_root.index = root.index
+    names: List[str] = []
+    stack = [(root, iter(root.nodes.values()))]
+    while stack:
+        _parent, nodes = stack[-1]
+        node = next(nodes, None)
+        if node is None:
+            stack.pop()
+            if names:
+                names.pop()
+            continue
+
+        names.append(node.name)
+        stack.append((node, iter(node.nodes.values())))
+        if node.size is not None or node.difference is not None:
+            reversed_node = _add_node(names[::-1], reversed_root, node.size, '', node.difference)
+            reversed_node.time_sizes = _add_time_sizes(reversed_node.time_sizes, node.time_sizes)
+
+    return reversed_root
+
+
+def _print_summary(path: str, sizename: str, root: Node) -> None:
+    self_sizes, total_sizes = _summary_sizes(root)
+    root_total_size = sum(self_sizes.values()) + (root.size or 0.0)
+    try:
+        with open(path, 'w') as file:
+            file.write('self_%s\tself_percent\ttotal_%s\ttotal_percent\tname\n'
+                       % (sizename, sizename))
+            for name, self_size in sorted(self_sizes.items(), key=_by_summary_cost):
+                total_size = total_sizes[name]
+                file.write('%s\t%.2f\t%s\t%.2f\t%s\n'
+                           % (_js_number(self_size), _percent(self_size, root_total_size),
+                              _js_number(total_size), _percent(total_size, root_total_size),
+                              name))
+    except OSError as error:
+        sys.stderr.write('flameview.py: %s: error: %s\n' % (path, error.strerror))
+        sys.exit(1)
+
+
+# The self and total size of each name; the total only counts the outermost recursive nodes.
+def _summary_sizes(root: Node) -> Tuple[Dict[str, float], Dict[str, float]]:
+    self_sizes: Dict[str, float] = {}
+    total_sizes: Dict[str, float] = {}
+    path_names: Dict[str, int] = {}
+    path_sizes = [0.0]
+    stack = [(root, iter(root.nodes.values()))]
+    while stack:
+        parent, nodes = stack[-1]
+        node = next(nodes, None)
+        if node is not None:
+            self_sizes[node.name] = self_sizes.get(node.name, 0.0) + (node.size or 0.0)
+            path_names[node.name] = path_names.get(node.name, 0) + 1
+            path_sizes.append(node.size or 0.0)
+            stack.append((node, iter(node.nodes.values())))
+            continue
+
+        stack.pop()
+        total_size = path_sizes.pop()
+        if stack:
+            path_sizes[-1] += total_size
+            path_names[parent.name] -= 1
+            if path_names[parent.name] == 0:
+                del path_names[parent.name]
+                total_sizes[parent.name] = total_sizes.get(parent.name, 0.0) + total_size
+
+    return self_sizes, total_sizes
 
-    name_node.tooltip_html = tooltip_html
+
+def _by_summary_cost(item: Tuple[str, float]) -> Tuple[float, str]:
+    return -item[1], item[0]
+
+
+def _percent(size: float, total_size: float) -> float:
+    return 100.0 * size / total_size if total_size else 0.0
 
 
 SELF_NAME = "(self)"
 
 
-def _add_self_nodes(parent: Node) -> None:
-    for node in parent.nodes.values():
-        if len(node.name) == 1:
-            node.name = parent.name + ';' + node.name
-        _add_self_nodes(node)
-        if not node.nodes:
-            node.klass = 'leaf'
+def _add_self_nodes(root: Node) -> None:
+    stack = [(root, iter(root.nodes.values()))]
+    while stack:
+        parent, nodes = stack[-1]
+        node = next(nodes, None)
+        if node is not None:
+            if len(node.name) == 1:
+                node.name = intern(parent.name + ';' + node.name)
+            stack.append((node, iter(node.nodes.values())))
             continue
 
-        assert node.klass == 'sum'
-        if node.size is None:
-            continue
+        stack.pop()
+        if stack:
+            _add_self_node(parent)
+
+
+def _add_self_node(node: Node) -> None:
+    if not node.nodes:
+        node.klass = 'leaf'
+        return
+
+    assert node.klass == 'sum'
+    if node.size is None:
+        return
 
-        self_node = Node('%s;%s' % (node.name, SELF_NAME), node.size, node.tooltip_html)
-        self_node.label = SELF_NAME
-        self_node.klass = 'self'
+    self_node = Node(intern('%s;%s' % (node.name, SELF_NAME)), node.size, node.tooltip_html,
+                     node.difference)
+    self_node.label = SELF_NAME
+    self_node.klass = 'self'
+    self_node.time_sizes = node.time_sizes
+
+    node.nodes[SELF_NAME] = self_node
+    node.size = None
+    node.difference = None
+    node.time_sizes = None
+
+
+def _compute_sizes(root: Node) -> None:
+    root.total_size = root.size or 0.0
+    root.total_difference = root.difference
+    stack = [(root, iter(root.nodes.values()))]
+    while stack:
+        parent, nodes = stack[-1]
+        node = next(nodes, None)
+        if node is not None:
+            node.total_size = node.size or 0.0
+            node.total_difference = node.difference
+            stack.append((node, iter(node.nodes.values())))
+            continue
 
-        node.nodes[SELF_NAME] = self_node
-        node.size = None
+        stack.pop()
+        if stack:
+            grandparent = stack[-1][0]
+            grandparent.total_size += parent.total_size
+            grandparent.total_difference = _add_optional(grandparent.total_difference,
+                                                          parent.total_difference)
 
 
-def _compute_sizes(parent: Node) -> None:
-    parent.total_size = 0.0
-    if parent.size is not None:
-        parent.total_size += parent.size
-    for node in parent.nodes.values():
-        _compute_sizes(node)
-        parent.total_size += node.total_size
+def _prune_percent(args: Namespace) -> float:
+    return args.minpercent if args.detailpercent is None else args.detailpercent
 
 
 def _prune_small_nodes(root: Node, min_percent: float) -> None:
@@ -240,57 +1982,82 @@ def _prune_small_nodes(root: Node, min_percent: float) -> None:
     _prune_small_tree(root, min_size)
 
 
-def _prune_small_tree(parent: Node, min_size: float) -> None:
-    assert parent.total_size >= min_size
+def _prune_small_tree(root: Node, min_size: float) -> None:
+    assert root.total_size >= min_size
+    stack = [(root, iter(root.nodes.values()))]
+    while stack:
+        parent, nodes = stack[-1]
+        node = next(nodes, None)
+        if node is not None:
+            if node.total_size >= min_size:
+                stack.append((node, iter(node.nodes.values())))
+            continue
+
+        stack.pop()
+        _prune_small_children(parent, min_size)
+
 
+def _prune_small_children(parent: Node, min_size: float) -> None:
     large_nodes: Dict[str, Node] = {}
     total_small_nodes_size = 0.0
+    total_small_nodes_difference: Optional[float] = None
     for name, node in parent.nodes.items():
         if node.total_size < min_size:
             total_small_nodes_size += node.total_size
+            total_small_nodes_difference = _add_optional(total_small_nodes_difference,
+                                                         node.total_difference)
         else:
             large_nodes[name] = node
-            _prune_small_tree(node, min_size)
 
     if len(large_nodes) == len(parent.nodes):
         return
 
-    small_node = Node('(small)', total_small_nodes_size)
+    small_node = Node('(small)', total_small_nodes_size, '', total_small_nodes_difference)
     small_node.total_size = total_small_nodes_size
+    small_node.total_difference = total_small_nodes_difference
+    for name, node in parent.nodes.items():
+        if name not in large_nodes:
+            small_node.time_sizes = _add_tree_time_sizes(small_node.time_sizes, node)
     parent.nodes = large_nodes
     parent.nodes['...'] = small_node
 
 
+def _add_tree_time_sizes(total: Optional[Dict[int, float]],
+                         root: Node) -> Optional[Dict[int, float]]:
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        total = _add_time_sizes(total, node.time_sizes)
+        stack.extend(node.nodes.values())
+    return total
+
+
 def _size_tree_names(root: Node) -> Dict[str, int]:
     sizes: Dict[str, int] = {}
-    _size_names(root, sizes)
+    stack = [root]
+    while stack:
+        for node in stack.pop().nodes.values():
+            sizes[node.name] = sizes.get(node.name, 0) + 1
+            stack.append(node)
     return sizes
 
 
-def _size_names(parent: Node, sizes: Dict[str, int]):
-    for node in parent.nodes.values():
-        sizes[node.name] = sizes.get(node.name, 0) + 1
-        _size_names(node, sizes)
-
-
-def _compute_tree_groups(root: Node, sizes: Dict[str, int]) -> Dict[str, List[int]]:
-    groups: Dict[str, List[int]] = {}
-    _compute_groups(root, sizes, groups)
+def _compute_tree_groups(root: Node, sizes: Dict[str, int]) -> Dict[str, List[Node]]:
+    groups: Dict[str, List[Node]] = {}
+    stack = [root]
+    while stack:
+        for node in stack.pop().nodes.values():
+            stack.append(node)
+            if sizes[node.name] == 1:
+                continue
+            node.group = node.name
+            group = groups.get(node.name, None)
+            if group is None:
+                group = groups[node.name] = []
+            group.append(node)
     return groups
 
 
-def _compute_groups(parent: Node, sizes: Dict[str, int], groups: Dict[str, List[int]]) -> None:
-    for node in parent.nodes.values():
-        _compute_groups(node, sizes, groups)
-        if sizes[node.name] == 1:
-            continue
-        node.group = node.name
-        group = groups.get(node.name, None)
-        if group is None:
-            group = groups[node.name] = []
-        group.append(node.index)
-
-
 def _by_name(node: Node) -> str:
     return node.name
 
@@ -303,44 +2070,52 @@ def _by_input(node: Node) -> int:
     return node.index
 
 
-def _compute_tree_column_sizes(parent: Node, sort_key: Callable[[Node], Any]) -> List[float]:
+def _compute_tree_column_sizes(root: Node, sort_key: Callable[[Node], Any]) -> List[float]:
     column_sizes: List[float] = []
-    _compute_column_sizes(parent, sort_key, column_sizes)
+    _start_column(root, column_sizes)
+    stack = [(root, iter(sorted(root.nodes.values(), key=sort_key)))]
+    while stack:
+        parent, nodes = stack[-1]
+        node = next(nodes, None)
+        if node is not None:
+            _start_column(node, column_sizes)
+            stack.append((node, iter(sorted(node.nodes.values(), key=sort_key))))
+            continue
+
+        stack.pop()
+        if stack:
+            grandparent = stack[-1][0]
+            grandparent.columns_span = parent.column + parent.columns_span - grandparent.column
+
     return column_sizes
 
 
-def _compute_column_sizes(parent: Node, sort_key: Callable[[Node], Any],
-                          column_sizes: List[float]) -> None:
-    parent.column = len(column_sizes)
+def _start_column(node: Node, column_sizes: List[float]) -> None:
+    node.column = len(column_sizes)
 
-    if parent.nodes:
-        assert parent.size is None
-        for node in sorted(parent.nodes.values(), key=sort_key):
-            _compute_column_sizes(node, sort_key, column_sizes)
-            parent.columns_span = node.column + node.columns_span - parent.column
+    if node.nodes:
+        assert node.size is None
 
     else:
-        assert parent.size is not None
-        column_sizes.append(parent.size)
-        parent.columns_span = 1
+        assert node.size is not None
+        column_sizes.append(node.size)
+        node.columns_span = 1
 
 
 def _compute_tree_rows(root: Node) -> List[List[Node]]:
     rows: List[List[Node]] = []
-    _collect_unsorted_rows(root, rows, 0)
+    stack = [(root, 0)]
+    while stack:
+        node, level = stack.pop()
+        if len(rows) == level:
+            rows.append([])
+        rows[level].append(node)
+        for child in node.nodes.values():
+            stack.append((child, level + 1))
     _sort_rows(rows)
     return rows
 
 
-def _collect_unsorted_rows(parent: Node, rows: List[List[Node]], level: int) -> None:
-    if len(rows) == level:
-        rows.append([])
-    row = rows[level]
-    row.append(parent)
-    for node in parent.nodes.values():
-        _collect_unsorted_rows(node, rows, level + 1)
-
-
 def _sort_rows(rows: List[List[Node]]) -> None:
     for row in rows:
         row.sort(key=_by_column)
@@ -350,6 +2125,131 @@ def _by_column(node: Node) -> int:
     return node.column
 
 
+# Serve the graph of the unpruned tree. Each request for a subtree renders a copy of it, pruned
+# relative to its size, under the chain of its ancestors. Requests are handled one at a time since
+# rendering modifies the nodes.
+class GraphServer(HTTPServer):
+    def __init__(self, args: Namespace, root: Node, sort_key: Callable[[Node], Any]) -> None:
+        super().__init__(('localhost', args.serve), GraphRequestHandler)
+        self.args = args
+        self.root = root
+        self.sort_key = sort_key
+        self.nodes: Dict[int, Node] = {root.index: root}
+        self.parents: Dict[int, Node] = {}
+        stack = [root]
+        while stack:
+            parent = stack.pop()
+            for node in parent.nodes.values():
+                self.nodes[node.index] = node
+                self.parents[node.index] = parent
+                stack.append(node)
+
+    def print_page(self, file: TextIO) -> None:
+        groups, column_sizes, rows = self._subtree_graph(self.root)
+        _print_output_file(file, self.args, groups, column_sizes, rows, None)
+
+    def print_data(self, file: TextIO, cell_id: str) -> bool:
+        node = self.nodes.get(int(cell_id[1:])) if re.fullmatch(r'N\d+', cell_id) else None
+        if node is None:
+            return False
+        groups, column_sizes, rows = self._subtree_graph(node)
+        colors = _compute_colors(rows, self.args.colors, _max_difference(rows))
+        _print_graph_data(file, self.args, groups, column_sizes, rows, None, colors)
+        return True
+
+    def _subtree_graph(self, node: Node) \
+            -> Tuple[Dict[str, List[Node]], List[float], List[List[Node]]]:
+        prune_percent = _prune_percent(self.args)
+        min_size = 0.0
+        if 0 < prune_percent < 100:
+            min_size = node.total_size * prune_percent / 100.0
+        root = _copy_large_tree(node, min_size)
+        _prune_small_nodes(root, prune_percent)
+
+        parent = self.parents.get(node.index)
+        while parent is not None:
+            parent_copy = _copy_node(parent)
+            parent_copy.nodes[root.name] = root
+            root = parent_copy
+            parent = self.parents.get(parent.index)
+
+        groups = _compute_tree_groups(root, _size_tree_names(root))
+        column_sizes = _compute_tree_column_sizes(root, self.sort_key)
+        return groups, column_sizes, _compute_tree_rows(root)
+
+
+# Serve the graph page (/) and the subtree data of a cell (/data?cell=ID).
+class GraphRequestHandler(BaseHTTPRequestHandler):
+    server: GraphServer
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        url = urlsplit(self.path)
+        text = io.StringIO()
+        if url.path == '/':
+            self.server.print_page(text)
+            self._send_text('text/html', text.getvalue())
+        elif url.path == '/data':
+            cell_id = parse_qs(url.query).get('cell', [''])[0]
+            if self.server.print_data(text, cell_id):
+                self._send_text('application/javascript', text.getvalue())
+            else:
+                self.send_error(404, 'Unknown cell: %s' % cell_id)
+        else:
+            self.send_error(404)
+
+    def _send_text(self, content_type: str, text: str) -> None:
+        data = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', '%s; charset=utf-8' % content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _serve_graph(args: Namespace, root: Node, sort_key: Callable[[Node], Any]) -> None:
+    args.renderer = 'canvas'
+    try:
+        server = GraphServer(args, root, sort_key)
+    except OSError as error:
+        sys.stderr.write('flameview.py: error: can\'t serve on port %s: %s\n'
+                         % (args.serve, error.strerror))
+        sys.exit(1)
+    sys.stderr.write('flameview.py: serving the graph on http://localhost:%s/\n'
+                     % server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Copy the nodes of at least the minimal size; the smaller nodes are shared, as pruning the copy
+# only reads them.
+def _copy_large_tree(root: Node, min_size: float) -> Node:
+    root_copy = _copy_node(root)
+    stack = [(root, root_copy)]
+    while stack:
+        parent, parent_copy = stack.pop()
+        for name, node in parent.nodes.items():
+            if node.total_size >= min_size:
+                node_copy = _copy_node(node)
+                stack.append((node, node_copy))
+                node = node_copy
+            parent_copy.nodes[name] = node
+    return root_copy
+
+
+def _copy_node(node: Node) -> Node:
+    node_copy = Node(node.name, node.size, node.tooltip_html, node.difference)
+    node_copy.index = node.index
+    node_copy.total_size = node.total_size
+    node_copy.total_difference = node.total_difference
+    node_copy.label = node.label
+    node_copy.klass = node.klass
+    return node_copy
+
+
 BEFORE_TITLE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -376,7 +2276,8 @@ BEFORE_CSS = """
 
 .leaf,
 .self,
-.sum {
+.sum,
+.small {
     position: absolute;
 }
 
@@ -401,7 +2302,8 @@ DEFAULT_APPEARANCE_CSS = """
 
 .leaf,
 .self,
-.sum {
+.sum,
+.small {
     border-width: 1px;
     border-style: solid;
     border-radius: 4px;
@@ -409,6 +2311,10 @@ DEFAULT_APPEARANCE_CSS = """
     text-align: center;
 }
 
+.small {
+    background-color: lightgray;
+}
+
 .group_hover .label {
     background-color: ivory !important;
 }
@@ -451,25 +2357,88 @@ BEFORE_JAVASCRIPT = """
 """[1:]
 
 
-BEFORE_HTML = """
+BEHAVIOR_JAVASCRIPT = """
 /*** Behavior: ***/
 
 // The total size of everything (for computing percentages).
 // Computed on load.
 var total_size = null;
 
+// The ids of all the cells.
+// Computed on load.
+var cell_ids = null;
+
 // The list of currently selected cell ids.
 var selected_cell_ids = [];
 
+// Prefix sums of the sizes of the visible columns, that is, the total size of
+// the visible columns before each column index (with one extra final entry).
+// Computed every time the selected cells change.
+var visible_columns_offsets = null;
+
+// Prefix counts of the visible columns, that is, the number of visible columns
+// before each column index (with one extra final entry). Computed every time
+// the selected cells change.
+var visible_columns_counts = null;
+
+// The total size of the visible columns.
+// Computed every time the selected cells change.
+var visible_size = null;
+
 // The id of the root cell that covers everything (by convention).
 var root_id = "N0";
 
+// Additional functions to invoke at the end of loading.
+var load_hooks = [];
+
+// A function to invoke for zooming into a single cell instead of just
+// selecting it, if any.
+var zoom_hook = null;
+
+// The ids of the children of each cell, sorted by their columns, for covering
+// the children which are too small to display by placeholders.
+// Computed on load, only if min_visible_percent is set.
+var cells_children_ids = null;
+
+// The [start, end) interval of the columns used by a cell.
+function cell_columns_interval(cell_data) {
+    "use strict";
+    var columns = cell_data.columns;
+    return [columns[0], columns[0] + columns[1]];
+}
+
+// Intersect two sorted lists of disjoint [start, end) column intervals.
+function intersect_columns_intervals(left_intervals, right_intervals) {
+    "use strict";
+    var intervals = [];
+    var left_index = 0;
+    var right_index = 0;
+    while (left_index < left_intervals.length &&
+            right_index < right_intervals.length) {
+        var left_interval = left_intervals[left_index];
+        var right_interval = right_intervals[right_index];
+        var start = Math.max(left_interval[0], right_interval[0]);
+        var end = Math.min(left_interval[1], right_interval[1]);
+        if (start < end) {
+            intervals.push([start, end]);
+        }
+        if (left_interval[1] < right_interval[1]) {
+            left_index += 1;
+        } else {
+            right_index += 1;
+        }
+    }
+    return intervals;
+}
+
 // Compute which columns are visible given the current selection.
-function compute_visible_columns_mask() {
+//
+// The result is a sorted list of disjoint [start, end) column intervals.
+function compute_visible_columns_intervals() {
     "use strict";
     if (selected_cell_ids.length === 1) {
         var selected_cell_id = selected_cell_ids[0];
-        return cells_data[selected_cell_id].columns_mask;
+        return [cell_columns_interval(cells_data[selected_cell_id])];
     }
 
     var lowest_cell_id = undefined;
@@ -482,29 +2451,53 @@ function compute_visible_columns_mask() {
         }
     });
 
-    var visible_columns_mask = cells_data[lowest_cell_id].columns_mask.slice();
+    var visible_columns_intervals = [
+        cell_columns_interval(cells_data[lowest_cell_id])
+    ];
     selected_cell_ids.forEach(function (cell_id) {
         var group_id = cells_data[cell_id].group_id;
-        var columns_mask = (
-            group_id
-            ? groups_data[group_id].columns_mask
-            : cells_data[cell_id].columns_mask
+        var columns_intervals = (
+            group_id !== undefined
+            ? groups_data[group_id].columns_intervals
+            : [cell_columns_interval(cells_data[cell_id])]
+        );
+        visible_columns_intervals = intersect_columns_intervals(
+            visible_columns_intervals,
+            columns_intervals
         );
-        columns_mask.forEach(function (is_column_in_group, column_index) {
-            visible_columns_mask[column_index] *= is_column_in_group;
-        });
     });
-    return visible_columns_mask;
+    return visible_columns_intervals;
 }
 
-// Compute the total size of the visible columns.
-function compute_visible_size(visible_columns_mask) {
+// Compute the prefix sums and counts of the visible columns.
+function compute_visible_columns_prefixes(visible_columns_intervals) {
     "use strict";
-    var visible_size = 0;
-    column_sizes.forEach(function (column_size, column_index) {
-        visible_size += column_size * visible_columns_mask[column_index];
+    var columns_count = column_sizes.length;
+    visible_columns_offsets = new Float64Array(columns_count + 1);
+    visible_columns_counts = new Int32Array(columns_count + 1);
+    var visible_offset = 0;
+    var visible_count = 0;
+    var column_index = 0;
+    visible_columns_intervals.forEach(function (interval) {
+        while (column_index < interval[0]) {
+            visible_columns_offsets[column_index] = visible_offset;
+            visible_columns_counts[column_index] = visible_count;
+            column_index += 1;
+        }
+        while (column_index < interval[1]) {
+            visible_columns_offsets[column_index] = visible_offset;
+            visible_columns_counts[column_index] = visible_count;
+            visible_offset += column_sizes[column_index];
+            visible_count += 1;
+            column_index += 1;
+        }
     });
-    return visible_size;
+    while (column_index <= columns_count) {
+        visible_columns_offsets[column_index] = visible_offset;
+        visible_columns_counts[column_index] = visible_count;
+        column_index += 1;
+    }
+    visible_size = visible_offset;
 }
 
 // Convert a number to a human-friendly precision.
@@ -526,229 +2519,1184 @@ function stringify(number) {
         precision *= 10;
         result = Math.round(number * precision) / precision;
     }
-    precision *= 10;
-    return Math.round(number * precision) / precision;
+    precision *= 10;
+    return Math.round(number * precision) / precision;
+}
+
+// Compute the horizontal layout of a cell given the current selection.
+//
+// Returns null if the cell is not visible, or is too small relative to the
+// visible size. Otherwise, returns the left offset and the width of the cell in
+// pixels, and the visible size of the cell.
+function compute_cell_layout(scale_factor, cell_id) {
+    "use strict";
+    var cell_interval = cell_columns_interval(cells_data[cell_id]);
+    var start = cell_interval[0];
+    var end = cell_interval[1];
+    if (visible_columns_counts[end] === visible_columns_counts[start]) {
+        return null;
+    }
+
+    var cell_offset = visible_columns_offsets[start];
+    var cell_size = visible_columns_offsets[end] - cell_offset;
+    if (cell_size < visible_size * min_visible_percent / 100) {
+        return null;
+    }
+
+    var left = Math.round(cell_offset * scale_factor);
+    var width = Math.round((cell_offset + cell_size) * scale_factor) - left;
+    return {"left": left, "width": width, "size": cell_size};
+}
+
+// Compute the horizontal layout of a placeholder covering the visible cells
+// between the start and end visible offsets.
+function compute_small_layout(scale_factor, level, start, end) {
+    "use strict";
+    var left = Math.round(start * scale_factor);
+    var width = Math.round(end * scale_factor) - left;
+    return {"level": level, "left": left, "width": width, "size": end - start};
+}
+
+// Compute the layouts of the placeholders covering the children of the
+// displayed cells which are too small to display.
+//
+// Each run of consecutive such children is merged into a single placeholder,
+// similarly to the "(small)" cells of pruned nodes.
+function compute_small_layouts(scale_factor) {
+    "use strict";
+    var layouts = [];
+    if (!cells_children_ids) {
+        return layouts;
+    }
+
+    var min_size = visible_size * min_visible_percent / 100;
+    Object.keys(cells_children_ids).forEach(function (parent_id) {
+        if (!compute_cell_layout(scale_factor, parent_id)) {
+            return;
+        }
+
+        var level = cells_data[parent_id].level + 1;
+        var start = null;
+        var end = null;
+        cells_children_ids[parent_id].forEach(function (cell_id) {
+            var interval = cell_columns_interval(cells_data[cell_id]);
+            if (visible_columns_counts[interval[1]] ===
+                    visible_columns_counts[interval[0]]) {
+                return;
+            }
+
+            var cell_start = visible_columns_offsets[interval[0]];
+            var cell_end = visible_columns_offsets[interval[1]];
+            if (cell_end - cell_start < min_size) {
+                if (start === null) {
+                    start = cell_start;
+                }
+                end = cell_end;
+                return;
+            }
+
+            if (start !== null) {
+                layouts.push(compute_small_layout(scale_factor, level, start,
+                        end));
+                start = null;
+            }
+        });
+        if (start !== null) {
+            layouts.push(compute_small_layout(scale_factor, level, start, end));
+        }
+    });
+    return layouts;
+}
+
+// Update the computed data in the tooltip of a cell, if it has one.
+function update_cell_computed(cell, cell_size) {
+    "use strict";
+    var computed = cell.querySelector(".computed");
+    if (!computed) {
+        return;
+    }
+
+    var computed_text = stringify(cell_size);
+    if (cell_size === total_size) {
+        computed.innerText = computed_text;
+        return;
+    }
+
+    if (visible_size !== total_size && cell_size !== visible_size) {
+        var percentage_of_visible = 100 * cell_size / visible_size;
+        computed_text += "<br/>" + stringify(percentage_of_visible) +
+                "% out of: " + stringify(visible_size) + " visible";
+    }
+
+    var percentage_of_total = 100 * cell_size / total_size;
+    computed_text += "<br/>" + stringify(percentage_of_total) +
+            "% out of: " + stringify(total_size) + " total";
+
+    computed.innerHTML = computed_text;
+}
+
+// Update the graph width and compute the scale factor from sizes to pixels.
+function compute_scale_factor() {
+    "use strict";
+    var graph_width = document.getElementById("width").clientWidth;
+    var graph = document.getElementById("graph");
+    graph.style.width = graph_width + "px";
+    return (graph_width - 2) / visible_size;
+}
+
+// Update the visible columns and all the cells.
+//
+// Must be done every time the selected cells change.
+function update_selection() {
+    "use strict";
+    compute_visible_columns_prefixes(compute_visible_columns_intervals());
+    update_cells();
+}
+
+// Select just a single cell.
+function select_single_cell(cell_id) {
+    "use strict";
+    selected_cell_ids.forEach(function (selected_cell_id) {
+        set_cell_selected(selected_cell_id, false);
+    });
+    selected_cell_ids = [cell_id];
+    set_cell_selected(cell_id, true);
+    update_selection();
+}
+
+// Select a cell for filtering the visible graph content.
+//
+// If not is_toggle, just select (or zoom into) the cell. Otherwise add/remove
+// the cell to/from the selected cells.
+//
+// When multiple cells are selected, the lowest-level one restricts the set of
+// columns, and each additional higher-level cell further restricts the columns
+// to these covered by the group the cell belongs to.
+function select_cell(cell_id, is_toggle) {
+    "use strict";
+    if (!is_toggle) {
+        if (zoom_hook) {
+            zoom_hook(cell_id);
+        } else {
+            select_single_cell(cell_id);
+        }
+        return;
+    }
+
+    var new_selected_cell_ids = [];
+    selected_cell_ids.forEach(function (selected_cell_id) {
+        if (selected_cell_id !== cell_id) {
+            new_selected_cell_ids.push(selected_cell_id);
+        }
+    });
+
+    if (new_selected_cell_ids.length === selected_cell_ids.length) {
+        selected_cell_ids.push(cell_id);
+        set_cell_selected(cell_id, true);
+        update_selection();
+        return;
+    }
+
+    set_cell_selected(cell_id, false);
+    selected_cell_ids = new_selected_cell_ids;
+
+    if (new_selected_cell_ids.length === 0) {
+        selected_cell_ids = [root_id];
+        set_cell_selected(root_id, true);
+    }
+
+    update_selection();
+}
+
+// Collect the ids of the cells of each level, sorted by their columns.
+function compute_levels_cell_ids() {
+    "use strict";
+    var levels = [];
+    cell_ids.forEach(function (cell_id) {
+        var level = cells_data[cell_id].level;
+        while (levels.length <= level) {
+            levels.push([]);
+        }
+        levels[level].push(cell_id);
+    });
+    levels.forEach(function (level_cell_ids) {
+        level_cell_ids.sort(function (left_cell_id, right_cell_id) {
+            return (
+                cells_data[left_cell_id].columns[0] -
+                cells_data[right_cell_id].columns[0]
+            );
+        });
+    });
+    return levels;
+}
+
+// Collect the ids of the children of each cell, sorted by their columns.
+//
+// The children of a cell are the cells of the next level whose columns are
+// inside the columns of the cell.
+function compute_cells_children_ids() {
+    "use strict";
+    var children_ids = {};
+    var levels = compute_levels_cell_ids();
+    levels.forEach(function (level_cell_ids, level) {
+        if (level === 0) {
+            return;
+        }
+
+        var parent_cell_ids = levels[level - 1];
+        var parent_index = 0;
+        level_cell_ids.forEach(function (cell_id) {
+            var start = cells_data[cell_id].columns[0];
+            while (parent_index + 1 < parent_cell_ids.length &&
+                    cell_columns_interval(
+                        cells_data[parent_cell_ids[parent_index]]
+                    )[1] <= start) {
+                parent_index += 1;
+            }
+
+            var parent_id = parent_cell_ids[parent_index];
+            if (!children_ids[parent_id]) {
+                children_ids[parent_id] = [];
+            }
+            children_ids[parent_id].push(cell_id);
+        });
+    });
+    return children_ids;
+}
+
+// Compute the cell ids, total size and children from the generated data.
+function prepare_data() {
+    "use strict";
+    cell_ids = Object.keys(cells_data);
+    total_size = 0;
+    column_sizes.forEach(function (column_size) {
+        total_size += column_size;
+    });
+    cells_children_ids = (
+        min_visible_percent > 0
+        ? compute_cells_children_ids()
+        : null
+    );
+}
+
+function on_load() {
+    "use strict";
+    prepare_data();
+    prepare_rendering();
+    select_single_cell(root_id);
+    load_hooks.forEach(function (load_hook) {
+        load_hook();
+    });
+}
+"""
+
+CELL_EVENTS_JAVASCRIPT = """
+// All cell events are handled by a single set of handlers attached to the
+// graph, which find the cell the event occurred in.
+
+// Find the cell containing an element, if any.
+function containing_cell(element) {
+    "use strict";
+    while (element && !cells_data[element.id]) {
+        element = element.parentElement;
+    }
+    return element;
+}
+
+// Whether an element is inside a tooltip.
+function is_in_tooltip(element) {
+    "use strict";
+    while (element && !cells_data[element.id]) {
+        if (element.classList.contains("tooltip")) {
+            return true;
+        }
+        element = element.parentElement;
+    }
+    return false;
+}
+
+// Add or remove a class to all the cells in a group (which exist in the DOM).
+function set_group_class(cell_id, class_name, is_set) {
+    "use strict";
+    var group_id = cells_data[cell_id].group_id;
+    var group_cell_ids = (
+        group_id !== undefined
+        ? groups_data[group_id].cell_ids
+        : [cell_id]
+    );
+    group_cell_ids.forEach(function (group_cell_id) {
+        var group_cell = document.getElementById(group_cell_id);
+        if (!group_cell) {
+            return;
+        }
+        if (is_set) {
+            group_cell.classList.add(class_name);
+        } else {
+            group_cell.classList.remove(class_name);
+        }
+    });
+}
+
+// Cell hover highlights all cells in a group.
+// The cell itself is highlighted using the :hover CSS selector.
+// The other cells in the group are highlighted using the group_hover class.
+
+// Highlight all group cells on entry.
+function on_over(event) {
+    "use strict";
+    var cell = containing_cell(event.target);
+    if (!cell || cell.contains(event.relatedTarget)) {
+        return;
+    }
+    ensure_cell_tooltip(cell);
+    set_group_class(cell.id, "group_hover", true);
+}
+
+// Unhighlight all group cells on exit.
+function on_out(event) {
+    "use strict";
+    var cell = containing_cell(event.target);
+    if (!cell || cell.contains(event.relatedTarget)) {
+        return;
+    }
+    set_group_class(cell.id, "group_hover", false);
+}
+
+// Mark a cell as selected or not (if it exists in the DOM).
+function set_cell_selected(cell_id, is_selected) {
+    "use strict";
+    var cell = document.getElementById(cell_id);
+    if (!cell) {
+        return;
+    }
+    if (is_selected) {
+        cell.classList.add("selected");
+    } else {
+        cell.classList.remove("selected");
+    }
+}
+
+// Handle a click on a cell.
+//
+// A simple click just shows the selected cell columns,
+// a control-click adds/removes selected cells,
+// an alt-click toggles tooltips.
+function on_click(event) {
+    "use strict";
+    var cell = containing_cell(event.target);
+    if (!cell) {
+        return;
+    }
+
+    if (event.altKey) {
+        var graph = document.getElementById("graph");
+        if (is_in_tooltip(event.target)) {
+            graph.classList.remove("tooltipped");
+        } else {
+            graph.classList.add("tooltipped");
+        }
+        return;
+    }
+
+    select_cell(cell.id, event.ctrlKey);
+}
+
+// Attach the event handlers to the graph.
+function prepare_rendering() {
+    "use strict";
+    var graph = document.getElementById("graph");
+    graph.addEventListener("click", on_click);
+    graph.addEventListener("mouseover", on_over);
+    graph.addEventListener("mouseout", on_out);
+}
+"""
+
+TOOLTIP_JAVASCRIPT = """
+// Fill the content of a tooltip for a cell.
+function fill_tooltip(tooltip, cell_id) {
+    "use strict";
+    var cell_data = cells_data[cell_id];
+    var tooltip_html = "<span class=\\"name\\"></span><br/>\\n<hr/>\\n" +
+            "<div class=\\"basic\\">" + size_name +
+            ": <span class=\\"computed\\"></span></div>\\n";
+    if (cell_data.difference !== undefined) {
+        tooltip_html += "<div class=\\"difference\\">" + size_name +
+                " difference: " + cell_data.difference + "</div>\\n";
+    }
+    if (cell_data.tooltip) {
+        tooltip_html += "<div class=\\"extra\\">\\n" + cell_data.tooltip +
+                "</div>\\n";
+    }
+    tooltip.innerHTML = tooltip_html;
+    tooltip.querySelector(".name").textContent = names_data[
+        cell_data.name === undefined
+        ? cell_data.label
+        : cell_data.name
+    ];
+    update_cell_computed(tooltip, compute_cell_layout(1, cell_id).size);
+}
+"""
+
+DOM_RENDERER_JAVASCRIPT = """
+/*** Rendering (all cells are created in advance): ***/
+
+// Update all the cells visibility and width.
+//
+// Must be done every time the display width changes.
+function update_cells() {
+    "use strict";
+    var scale_factor = compute_scale_factor();
+    cell_ids.forEach(function (cell_id) {
+        var cell = document.getElementById(cell_id);
+        var layout = compute_cell_layout(scale_factor, cell_id);
+        if (!layout) {
+            cell.style.display = "none";
+            return;
+        }
+
+        cell.style.display = null;
+        cell.style.left = layout.left + "px";
+        cell.style.width = layout.width + "px";
+        update_cell_computed(cell, layout.size);
+    });
+    update_small_cells(scale_factor);
+}
+
+// Ensure a cell has a tooltip before hovering over it.
+//
+// All the tooltips are created in advance so there's nothing to do.
+function ensure_cell_tooltip() {
+    "use strict";
+    return;
+}
+"""
+
+LAZY_RENDERER_JAVASCRIPT = """
+/*** Rendering (cells are created on demand): ***/
+
+// Cells narrower than this (in pixels) are not created.
+var min_cell_width = 1;
+
+// Create the DOM element of a cell.
+function create_cell(cell_id) {
+    "use strict";
+    var cell_data = cells_data[cell_id];
+    var cell = document.createElement("div");
+    cell.id = cell_id;
+    cell.className = cell_data.klass + " C" + cell_data.color;
+    if (selected_cell_ids.indexOf(cell_id) >= 0) {
+        cell.classList.add("selected");
+    }
+
+    var label = document.createElement("div");
+    label.className = "label";
+    label.textContent = names_data[cell_data.label];
+    cell.appendChild(label);
+
+    document.getElementById("R" + cell_data.level).appendChild(cell);
+    return cell;
+}
+
+// Update all the cells visibility and width, creating the DOM elements of the
+// cells which are wide enough and removing the rest.
+//
+// Must be done every time the display width changes.
+function update_cells() {
+    "use strict";
+    var scale_factor = compute_scale_factor();
+    cell_ids.forEach(function (cell_id) {
+        var cell = document.getElementById(cell_id);
+        var layout = compute_cell_layout(scale_factor, cell_id);
+        if (!layout || layout.width < min_cell_width) {
+            if (cell) {
+                cell.parentNode.removeChild(cell);
+            }
+            return;
+        }
+
+        if (!cell) {
+            cell = create_cell(cell_id);
+        }
+        cell.style.left = layout.left + "px";
+        cell.style.width = layout.width + "px";
+        update_cell_computed(cell, layout.size);
+    });
+    update_small_cells(scale_factor);
+}
+
+// Ensure a cell has a tooltip before hovering over it.
+function ensure_cell_tooltip(cell) {
+    "use strict";
+    if (cell.querySelector(".tooltip")) {
+        return;
+    }
+
+    var tooltip = document.createElement("div");
+    tooltip.className = "tooltip";
+    fill_tooltip(tooltip, cell.id);
+    cell.insertBefore(tooltip, cell.firstChild);
+}
+"""
+
+CANVAS_RENDERER_JAVASCRIPT = """
+/*** Rendering (cells are drawn on a canvas): ***/
+
+// Cells narrower than this (in pixels) are not drawn.
+var min_cell_width = 1;
+
+// Labels are not drawn in cells narrower than this (in pixels).
+var min_label_width = 8;
+
+// The fill color of the placeholders of cells too small to display.
+var small_color = "lightgray";
+
+// The ids of the cells of each level, sorted by their columns.
+// Computed on load.
+var levels_cell_ids = null;
+
+// The layout of the drawn cells of each level, sorted by their left offset.
+// Computed every time the cells are updated.
+var levels_drawn_cells = null;
+
+// The height of each row in pixels.
+// Measured on load.
+var row_height = null;
+
+// The font of the cell labels.
+// Measured on load.
+var label_font = null;
+
+// The id of the cell the mouse is hovering over, if any.
+var hovered_cell_id = null;
+
+// The ids of the cells in the group of the hovered cell (as object keys).
+var hovered_group_cell_ids = {};
+
+// Whether drawing the graph was requested for the next animation frame.
+var is_draw_requested = false;
+
+// The top offset of the row of a level in pixels.
+function level_top(level) {
+    "use strict";
+    if (is_inverted) {
+        return level * row_height;
+    }
+    return (levels_drawn_cells.length - 1 - level) * row_height;
+}
+
+// Draw a single cell.
+function draw_cell(context, layout, top) {
+    "use strict";
+    var label = "(small)";
+    context.fillStyle = small_color;
+    if (layout.id) {
+        var cell_data = cells_data[layout.id];
+        label = names_data[cell_data.label];
+        context.fillStyle = (
+            hovered_group_cell_ids[layout.id]
+            ? "ivory"
+            : colors_data[cell_data.color]
+        );
+    }
+    context.fillRect(layout.left, top, layout.width, row_height);
+    context.strokeRect(layout.left + 0.5, top + 0.5,
+            layout.width - 1, row_height - 1);
+    if (layout.width < min_label_width) {
+        return;
+    }
+
+    context.save();
+    context.beginPath();
+    context.rect(layout.left + 1, top, layout.width - 2, row_height);
+    context.clip();
+    context.font = (
+        selected_cell_ids.indexOf(layout.id) >= 0
+        ? "bold " + label_font
+        : label_font
+    );
+    context.fillStyle = "black";
+    context.fillText(label, layout.left + layout.width / 2,
+            top + row_height / 2);
+    context.restore();
+}
+
+// Draw all the visible cells.
+function draw_cells() {
+    "use strict";
+    is_draw_requested = false;
+    var canvas = document.getElementById("canvas");
+    var width = document.getElementById("width").clientWidth;
+    var height = levels_drawn_cells.length * row_height;
+    var ratio = window.devicePixelRatio || 1;
+    canvas.width = Math.round(width * ratio);
+    canvas.height = Math.round(height * ratio);
+    canvas.style.width = width + "px";
+    canvas.style.height = height + "px";
+
+    var context = canvas.getContext("2d");
+    context.setTransform(ratio, 0, 0, ratio, 0, 0);
+    context.clearRect(0, 0, width, height);
+    context.lineWidth = 1;
+    context.strokeStyle = "black";
+    context.textAlign = "center";
+    context.textBaseline = "middle";
+    levels_drawn_cells.forEach(function (drawn_cells, level) {
+        var top = level_top(level);
+        drawn_cells.forEach(function (layout) {
+            draw_cell(context, layout, top);
+        });
+    });
+}
+
+// Draw all the visible cells in the next animation frame.
+function request_draw() {
+    "use strict";
+    if (!is_draw_requested) {
+        is_draw_requested = true;
+        window.requestAnimationFrame(draw_cells);
+    }
+}
+
+// Update the layout of all the cells, and redraw them.
+//
+// Must be done every time the display width changes.
+function update_cells() {
+    "use strict";
+    var scale_factor = compute_scale_factor();
+    levels_drawn_cells = levels_cell_ids.map(function (level_cell_ids) {
+        var drawn_cells = [];
+        level_cell_ids.forEach(function (cell_id) {
+            var layout = compute_cell_layout(scale_factor, cell_id);
+            if (layout && layout.width >= min_cell_width) {
+                layout.id = cell_id;
+                drawn_cells.push(layout);
+            }
+        });
+        return drawn_cells;
+    });
+
+    var small_layouts = compute_small_layouts(scale_factor);
+    small_layouts.forEach(function (layout) {
+        var drawn_cells = levels_drawn_cells[layout.level];
+        if (drawn_cells && layout.width >= min_cell_width) {
+            layout.id = null;
+            drawn_cells.push(layout);
+        }
+    });
+    if (small_layouts.length > 0) {
+        levels_drawn_cells.forEach(function (drawn_cells) {
+            drawn_cells.sort(function (left_layout, right_layout) {
+                return left_layout.left - right_layout.left;
+            });
+        });
+    }
+
+    if (hovered_cell_id) {
+        var layout = compute_cell_layout(1, hovered_cell_id);
+        if (layout) {
+            update_cell_computed(document.getElementById("tooltip"),
+                    layout.size);
+        }
+    }
+    request_draw();
+}
+
+// Find the drawn cell at some position, if any.
+function cell_id_at(x, y) {
+    "use strict";
+    var row = Math.floor(y / row_height);
+    var level = (
+        is_inverted
+        ? row
+        : levels_drawn_cells.length - 1 - row
+    );
+    var drawn_cells = levels_drawn_cells[level];
+    if (!drawn_cells) {
+        return null;
+    }
+
+    var low = 0;
+    var high = drawn_cells.length;
+    while (low < high) {
+        var middle = Math.floor((low + high) / 2);
+        if (drawn_cells[middle].left <= x) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    var layout = drawn_cells[low - 1];
+    if (layout && x < layout.left + layout.width) {
+        return layout.id;
+    }
+    return null;
+}
+
+// Find the drawn cell a mouse event occurred in, if any.
+function event_cell_id(event) {
+    "use strict";
+    var bounds = document.getElementById("canvas").getBoundingClientRect();
+    return cell_id_at(event.clientX - bounds.left, event.clientY - bounds.top);
+}
+
+// Cell hover highlights all cells in a group, and shows its tooltip.
+function set_hovered_cell(cell_id) {
+    "use strict";
+    if (cell_id === hovered_cell_id) {
+        return;
+    }
+
+    var tooltip = document.getElementById("tooltip");
+    hovered_cell_id = cell_id;
+    hovered_group_cell_ids = {};
+    if (!cell_id) {
+        tooltip.style.visibility = "hidden";
+        request_draw();
+        return;
+    }
+
+    var group_id = cells_data[cell_id].group_id;
+    var group_cell_ids = (
+        group_id !== undefined
+        ? groups_data[group_id].cell_ids
+        : [cell_id]
+    );
+    group_cell_ids.forEach(function (group_cell_id) {
+        hovered_group_cell_ids[group_cell_id] = true;
+    });
+    fill_tooltip(tooltip, cell_id);
+    request_draw();
+}
+
+// Track the hovered cell and move its tooltip with the mouse.
+function on_move(event) {
+    "use strict";
+    var tooltip = document.getElementById("tooltip");
+    if (tooltip.contains(event.target)) {
+        return;
+    }
+
+    set_hovered_cell(event_cell_id(event));
+    if (!hovered_cell_id) {
+        return;
+    }
+
+    var graph = document.getElementById("graph");
+    var bounds = graph.getBoundingClientRect();
+    tooltip.style.left = (event.clientX - bounds.left + 12) + "px";
+    tooltip.style.top = (event.clientY - bounds.top + 12) + "px";
+    tooltip.style.visibility = (
+        graph.classList.contains("tooltipped")
+        ? "visible"
+        : "hidden"
+    );
+}
+
+// Unhighlight all group cells when leaving the graph.
+function on_out(event) {
+    "use strict";
+    if (!document.getElementById("graph").contains(event.relatedTarget)) {
+        set_hovered_cell(null);
+    }
+}
+
+// The selected cells are drawn in bold when the cells are updated.
+function set_cell_selected() {
+    "use strict";
+    return;
+}
+
+// Handle a click on the graph.
+//
+// A simple click just shows the selected cell columns,
+// a control-click adds/removes selected cells,
+// an alt-click toggles tooltips.
+function on_click(event) {
+    "use strict";
+    var graph = document.getElementById("graph");
+    var tooltip = document.getElementById("tooltip");
+    var is_on_tooltip = tooltip.contains(event.target);
+
+    if (event.altKey) {
+        if (is_on_tooltip) {
+            graph.classList.remove("tooltipped");
+            tooltip.style.visibility = "hidden";
+        } else {
+            graph.classList.add("tooltipped");
+        }
+        return;
+    }
+
+    var cell_id = (
+        is_on_tooltip
+        ? hovered_cell_id
+        : event_cell_id(event)
+    );
+    if (cell_id) {
+        select_cell(cell_id, event.ctrlKey);
+    }
 }
 
-// Update the visibility and width of a specific cell.
-function update_cell(visible_columns_mask,
-        scale_factor, visible_size, cell_id) {
+// Collect the cells of each level.
+function prepare_levels() {
     "use strict";
-    var cell_data = cells_data[cell_id];
-    var cell = document.getElementById(cell_id);
+    levels_cell_ids = compute_levels_cell_ids();
+}
 
-    var cell_offset_is_done = false;
-    var cell_offset = 0;
-    var cell_size = 0;
-    cell_data.columns_mask.forEach(function (is_column_used, column_index) {
-        if (visible_columns_mask[column_index] > 0) {
-            if (is_column_used > 0) {
-                cell_offset_is_done = true;
-                cell_size += column_sizes[column_index];
-            } else if (!cell_offset_is_done) {
-                cell_offset += column_sizes[column_index];
-            }
+// Measure the row height and label font, collect the cells of each level, and
+// attach the event handlers to the graph.
+function prepare_rendering() {
+    "use strict";
+    var probe = document.getElementById("probe");
+    row_height = probe.querySelector(".height").offsetHeight;
+    var label_style = window.getComputedStyle(probe.querySelector(".label"));
+    label_font = label_style.fontSize + " " + label_style.fontFamily;
+    probe.parentNode.removeChild(probe);
+
+    prepare_levels();
+
+    var graph = document.getElementById("graph");
+    graph.addEventListener("click", on_click);
+    graph.addEventListener("mousemove", on_move);
+    graph.addEventListener("mouseout", on_out);
+}
+"""
+
+SMALL_CELLS_JAVASCRIPT = """
+/*** Placeholders of cells too small to display: ***/
+
+// The placeholder elements currently in the graph.
+var small_cells = [];
+
+// Replace the placeholder elements of the cells too small to display.
+//
+// Must be done every time the cells are updated.
+function update_small_cells(scale_factor) {
+    "use strict";
+    small_cells.forEach(function (small_cell) {
+        small_cell.parentNode.removeChild(small_cell);
+    });
+    small_cells = [];
+    compute_small_layouts(scale_factor).forEach(function (layout) {
+        var row = document.getElementById("R" + layout.level);
+        if (!row || layout.width < 1) {
+            return;
         }
+
+        var small_cell = document.createElement("div");
+        small_cell.className = "small";
+        small_cell.title = stringify(layout.size);
+        small_cell.style.left = layout.left + "px";
+        small_cell.style.width = layout.width + "px";
+
+        var label = document.createElement("div");
+        label.className = "label";
+        label.textContent = "(small)";
+        small_cell.appendChild(label);
+
+        row.appendChild(small_cell);
+        small_cells.push(small_cell);
     });
+}
+"""
 
-    if (!cell_offset_is_done) {
-        cell.style.display = "none";
-        return;
-    }
+RENDERERS_JAVASCRIPT = {
+    'dom': [CELL_EVENTS_JAVASCRIPT, SMALL_CELLS_JAVASCRIPT, DOM_RENDERER_JAVASCRIPT],
+    'lazy': [CELL_EVENTS_JAVASCRIPT, TOOLTIP_JAVASCRIPT, SMALL_CELLS_JAVASCRIPT,
+             LAZY_RENDERER_JAVASCRIPT],
+    'canvas': [TOOLTIP_JAVASCRIPT, CANVAS_RENDERER_JAVASCRIPT],
+}
 
-    cell.style.display = null;
-    var left = Math.round(cell_offset * scale_factor);
-    cell.style.left = left + "px";
-    var width = Math.round((cell_offset + cell_size) * scale_factor) - left;
-    cell.style.width = width + "px";
+TIMELINE_JAVASCRIPT = """
+/*** Timeline (restricting the graph to a range of time): ***/
 
-    var computed = cell.querySelector(".computed");
-    if (!computed) {
-        return;
-    }
+// The bucket of each timeline entry, decoded from the deltas on load.
+var timeline_buckets = null;
 
-    var computed_text = stringify(cell_size);
-    if (cell_size === total_size) {
-        computed.innerText = computed_text;
-        return;
-    }
+// The total size of each timeline bucket, computed on load.
+var timeline_totals = null;
 
-    if (visible_size !== total_size && cell_size !== visible_size) {
-        var percentage_of_visible = 100 * cell_size / visible_size;
-        computed_text += "<br/>" + stringify(percentage_of_visible) +
-                "% out of: " + stringify(visible_size) + " visible";
-    }
+// The [start, end) range of the buckets included in the graph.
+var timeline_range = null;
 
-    var percentage_of_total = 100 * cell_size / total_size;
-    computed_text += "<br/>" + stringify(percentage_of_total) +
-            "% out of: " + stringify(total_size) + " total";
+// The bucket where the mouse was pressed when dragging a new range, if any.
+var timeline_drag_bucket = null;
 
-    computed.innerHTML = computed_text;
+// The timeline canvas height in pixels.
+var timeline_height = 40;
+
+// Decode the bucket of each timeline entry and compute the bucket totals.
+function decode_timeline() {
+    "use strict";
+    var sizes = timeline.sizes;
+    var deltas = timeline.buckets_deltas;
+    timeline_buckets = new Int32Array(deltas.length);
+    timeline_totals = new Float64Array(timeline.buckets_count);
+    var entry_index = 0;
+    timeline.columns_ends.forEach(function (column_end) {
+        var bucket = 0;
+        while (entry_index < column_end) {
+            bucket += deltas[entry_index];
+            timeline_buckets[entry_index] = bucket;
+            timeline_totals[bucket] += sizes[entry_index];
+            entry_index += 1;
+        }
+    });
 }
 
-// Update all the cells visibility and width.
+// Re-weight the columns to only include the sizes in a range of buckets.
 //
-// Must be done every time the selected cell and/or the display width change.
-function update_cells() {
+// Returns false (and does nothing) if the range contains no data.
+function set_timeline_range(start, end) {
     "use strict";
-    var visible_columns_mask = compute_visible_columns_mask();
-    var visible_size = compute_visible_size(visible_columns_mask);
-    var graph_width = document.getElementById("width").clientWidth;
-    var graph = document.getElementById("graph");
-    graph.style.width = graph_width + "px";
-    var scale_factor = (graph_width - 2) / visible_size;
-    Object.keys(cells_data).forEach(function (cell_id) {
-        update_cell(visible_columns_mask, scale_factor, visible_size, cell_id);
+    var sizes = timeline.sizes;
+    var new_column_sizes = [];
+    var new_total_size = 0;
+    var entry_index = 0;
+    timeline.columns_ends.forEach(function (column_end) {
+        var column_size = 0;
+        while (entry_index < column_end) {
+            var bucket = timeline_buckets[entry_index];
+            if (start <= bucket && bucket < end) {
+                column_size += sizes[entry_index];
+            }
+            entry_index += 1;
+        }
+        new_column_sizes.push(column_size);
+        new_total_size += column_size;
+    });
+    if (new_total_size === 0) {
+        return false;
+    }
+
+    new_column_sizes.forEach(function (column_size, column_index) {
+        column_sizes[column_index] = column_size;
     });
+    total_size = new_total_size;
+    timeline_range = [start, end];
+    update_selection();
+    return true;
 }
 
-// Cell hover highlights all cells in a group.
-// The cell itself is highlighted using the :hover CSS selector.
-// The other cells in the group are highlighted using the group_hover class.
+// Describe a range of buckets in seconds since the first bucket.
+function describe_timeline_range(start, end) {
+    "use strict";
+    return "Time: " + stringify(start * timeline.duration) + " - " +
+            stringify(end * timeline.duration) + " seconds" + (
+        (start === 0 && end === timeline.buckets_count)
+        ? ""
+        : " (click the timeline to show all)"
+    );
+}
 
-// Highlight all group cells on entry.
-function on_over(event) {
+// Draw the timeline, highlighting the buckets in a range.
+function draw_timeline(start, end) {
     "use strict";
-    var cell = event.currentTarget;
-    var group_id = cells_data[cell.id].group_id;
-    if (group_id) {
-        groups_data[group_id].cell_ids.forEach(function (group_cell_id) {
-            var group_cell = document.getElementById(group_cell_id);
-            group_cell.classList.add("group_hover");
-        });
-    } else {
-        cell.classList.add("group_hover");
-    }
+    var canvas = document.getElementById("timeline");
+    var width = document.getElementById("width").clientWidth;
+    var ratio = window.devicePixelRatio || 1;
+    canvas.width = Math.round(width * ratio);
+    canvas.height = Math.round(timeline_height * ratio);
+    canvas.style.width = width + "px";
+    canvas.style.height = timeline_height + "px";
+
+    var context = canvas.getContext("2d");
+    context.setTransform(ratio, 0, 0, ratio, 0, 0);
+    context.clearRect(0, 0, width, timeline_height);
+
+    var max_total = 0;
+    timeline_totals.forEach(function (bucket_total) {
+        max_total = Math.max(max_total, bucket_total);
+    });
+    var bucket_width = width / timeline.buckets_count;
+    timeline_totals.forEach(function (bucket_total, bucket) {
+        var height = (
+            max_total > 0
+            ? Math.round(timeline_height * bucket_total / max_total)
+            : 0
+        );
+        context.fillStyle = (
+            (start <= bucket && bucket < end)
+            ? "rgb(230,120,0)"
+            : "rgb(200,200,200)"
+        );
+        context.fillRect(bucket * bucket_width, timeline_height - height,
+                Math.max(bucket_width, 1), height);
+    });
+    context.strokeStyle = "black";
+    context.lineWidth = 1;
+    context.strokeRect(0.5, 0.5, width - 1, timeline_height - 1);
+
+    document.getElementById("timeline_label").innerText =
+            describe_timeline_range(start, end);
 }
 
-// Unhighlight all group cells on exit.
-function on_out(event) {
+// Redraw the timeline with the current range.
+function update_timeline() {
     "use strict";
-    var cell = event.currentTarget;
-    var group_id = cells_data[cell.id].group_id;
-    if (group_id) {
-        groups_data[group_id].cell_ids.forEach(function (group_cell_id) {
-            var group_cell = document.getElementById(group_cell_id);
-            group_cell.classList.remove("group_hover");
-        });
-    } else {
-        cell.classList.remove("group_hover");
-    }
+    draw_timeline(timeline_range[0], timeline_range[1]);
 }
 
-// Select a cell for filtering the visible graph content.
-//
-// A simple click just shows the selected cell columns,
-// a control-click adds/removes selected cells,
-// an alt-click toggles tooltips.
-//
-// When multiple cells are selected, the lowest-level one restricts the set of
-// columns, and each additional higher-level cell further restricts the columns
-// to these covered by the group the cell belongs to.
-function on_click(event) {
+// The timeline bucket a mouse event occurred in.
+function event_timeline_bucket(event) {
     "use strict";
-    var cell = event.currentTarget;
+    var bounds = document.getElementById("timeline").getBoundingClientRect();
+    var bucket = Math.floor(
+        (event.clientX - bounds.left) * timeline.buckets_count / bounds.width
+    );
+    return Math.max(0, Math.min(timeline.buckets_count - 1, bucket));
+}
 
-    if (event.altKey) {
-        document.getElementById("graph").classList.add("tooltipped");
-        return;
-    }
+// The range of buckets between the dragged bucket and the current one.
+function dragged_timeline_range(event) {
+    "use strict";
+    var bucket = event_timeline_bucket(event);
+    return [
+        Math.min(bucket, timeline_drag_bucket),
+        Math.max(bucket, timeline_drag_bucket) + 1
+    ];
+}
 
-    if (!event.ctrlKey) {
-        selected_cell_ids.forEach(function (cell_id) {
-            document.getElementById(cell_id).classList.remove("selected");
-        });
-        selected_cell_ids = [cell.id];
-        cell.classList.add("selected");
-        update_cells();
-        return;
-    }
+// Start dragging a new range.
+function on_timeline_down(event) {
+    "use strict";
+    timeline_drag_bucket = event_timeline_bucket(event);
+    event.preventDefault();
+}
 
-    var new_selected_cell_ids = [];
-    selected_cell_ids.forEach(function (cell_id) {
-        if (cell_id !== cell.id) {
-            new_selected_cell_ids.push(cell_id);
-        }
-    });
+// Show the dragged range.
+function on_timeline_move(event) {
+    "use strict";
+    if (timeline_drag_bucket !== null) {
+        var range = dragged_timeline_range(event);
+        draw_timeline(range[0], range[1]);
+    }
+}
 
-    if (new_selected_cell_ids.length === selected_cell_ids.length) {
-        selected_cell_ids.push(cell.id);
-        cell.classList.add("selected");
-        update_cells();
+// Apply the dragged range. A click without dragging shows all the time range.
+function on_timeline_up(event) {
+    "use strict";
+    if (timeline_drag_bucket === null) {
         return;
     }
 
-    cell.classList.remove("selected");
-    selected_cell_ids = new_selected_cell_ids;
-
-    if (new_selected_cell_ids.length === 0) {
-        selected_cell_ids = [root_id];
-        document.getElementById(root_id).classList.add("selected");
+    var range = dragged_timeline_range(event);
+    if (range[1] - range[0] === 1) {
+        range = [0, timeline.buckets_count];
     }
+    timeline_drag_bucket = null;
+    set_timeline_range(range[0], range[1]);
+    update_timeline();
+}
 
-    update_cells();
+// Decode the timeline, draw it, and attach its event handlers.
+function on_timeline_load() {
+    "use strict";
+    decode_timeline();
+    timeline_range = [0, timeline.buckets_count];
+    update_timeline();
+
+    var canvas = document.getElementById("timeline");
+    canvas.addEventListener("mousedown", on_timeline_down);
+    window.addEventListener("mousemove", on_timeline_move);
+    window.addEventListener("mouseup", on_timeline_up);
+    window.addEventListener("resize", update_timeline);
 }
 
-// Disable tooltips.
-function disable_tooltip(event) {
+load_hooks.push(on_timeline_load);
+"""
+
+COMPRESSED_JAVASCRIPT = """
+/*** Compressed data: ***/
+
+// Decompress base64 encoded deflate compressed text.
+function decompress(compressed_text) {
     "use strict";
-    if (event.altKey) {
-        document.getElementById("graph").classList.remove("tooltipped");
-        event.stopPropagation();
-    }
+    return fetch(
+        "data:application/octet-stream;base64," + compressed_text
+    ).then(function (response) {
+        var stream = response.body.pipeThrough(
+            new DecompressionStream("deflate")
+        );
+        return new Response(stream).text();
+    });
 }
 
-// Attach handlers to table cells.
-function register_handlers() {
+// Decompress and execute the data javascript code and insert the graph HTML,
+// then properly initialize everything.
+function on_compressed_load() {
     "use strict";
-    Object.keys(cells_data).forEach(function (cell_id) {
-        var cell = document.getElementById(cell_id);
-        cell.onclick = on_click;
-        cell.onmouseover = on_over;
-        cell.onmouseout = on_out;
-        var tooltip = cell.querySelector(".tooltip");
-        if (tooltip) {
-            tooltip.onclick = disable_tooltip;
-        }
+    Promise.all([
+        decompress(compressed_javascript),
+        decompress(compressed_html)
+    ]).then(function (texts) {
+        var script = document.createElement("script");
+        script.text = texts[0];
+        document.head.appendChild(script);
+
+        var placeholder = document.getElementById("compressed");
+        placeholder.insertAdjacentHTML("beforebegin", texts[1]);
+        placeholder.parentNode.removeChild(placeholder);
+
+        on_load();
     });
 }
+"""
+
+SERVER_JAVASCRIPT = """
+/*** Server (zooming fetches the subtree of the cell): ***/
 
-function compute_groups_columns_masks() {
+// Replace the graph data with the subtree data of a zoomed cell.
+function load_cell_subtree(cell_id, data_text) {
     "use strict";
-    Object.keys(groups_data).forEach(function (group_id) {
-        var group_data = groups_data[group_id];
-        group_data.cell_ids.forEach(function (cell_id) {
-            var cell_data = cells_data[cell_id];
-            if (!group_data.columns_mask) {
-                group_data.columns_mask = cell_data.columns_mask.slice();
-            } else {
-                var columns_mask = cell_data.columns_mask;
-                columns_mask.forEach(function (is_column_used, column_index) {
-                    if (is_column_used > 0) {
-                        group_data.columns_mask[column_index] = 1;
-                    }
-                });
-            }
+    var script = document.createElement("script");
+    script.text = data_text;
+    document.head.appendChild(script);
+    document.head.removeChild(script);
+
+    set_hovered_cell(null);
+    prepare_data();
+    use_whole_size();
+    prepare_levels();
+    selected_cell_ids = [];
+    select_single_cell(cell_id);
+}
+
+// Zoom into a cell by fetching its subtree from the server, pruned relative
+// to the size of the cell.
+//
+// The cells of pruned small nodes are unknown to the server, so zooming into
+// them just selects them.
+function zoom_cell(cell_id) {
+    "use strict";
+    fetch("data?cell=" + cell_id).then(function (response) {
+        if (!response.ok) {
+            select_single_cell(cell_id);
+            return;
+        }
+        response.text().then(function (data_text) {
+            load_cell_subtree(cell_id, data_text);
         });
     });
 }
 
-function on_load() {
+// Percentages of the total are relative to the whole graph, not just the
+// fetched subtree.
+function use_whole_size() {
     "use strict";
-    register_handlers();
-    total_size = compute_visible_size(cells_data[root_id].columns_mask);
-    compute_groups_columns_masks();
-    on_click({
-        "currentTarget": document.getElementById(root_id),
-        "ctrlKey": false
-    });
+    total_size = whole_size;
 }
 
+zoom_hook = zoom_cell;
+load_hooks.push(use_whole_size);
+"""
+
+BEFORE_HTML = """
 // On resize, update all the cell widths.
 window.onresize = update_cells;
 
 // Properly initialize everything on load.
-window.onload = on_load;
+window.onload = %s;
 </script>
 </head>
 <body>
@@ -761,17 +3709,56 @@ AFTER_HTML = """
 """[1:]
 
 
-def _print_output_data(args: Namespace, groups: Dict[str, List[int]],
-                       column_sizes: List[float], rows: List[List[Node]]) -> None:
-    if args.output is None or args.output == '-':
-        _print_output_file(sys.stdout, args, groups, column_sizes, rows)
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+OUTPUT_CHUNK_COUNT = 1024
+
+
+def _print_output_data(args: Namespace, groups: Dict[str, List[Node]],
+                       column_sizes: List[float], rows: List[List[Node]],
+                       timeline: Optional[Timeline]) -> None:
+    with _open_output_file(args.output, args.gzip) as file:
+        _print_output_file(file, args, groups, column_sizes, rows, timeline)
+
+
+@contextmanager
+def _open_output_file(path: Optional[str], is_gzip: bool) -> Iterator[TextIO]:
+    if path is None or path == '-':
+        if is_gzip:
+            with _gzip_text_file(sys.stdout.buffer) as file:
+                yield file
+        else:
+            yield sys.stdout
+        return
+
+    if is_gzip or path.endswith('.gz'):
+        with open(path, 'wb') as binary_file:
+            with _gzip_text_file(binary_file) as file:
+                yield file
     else:
-        with open(args.output, 'w') as file:
-            _print_output_file(file, args, groups, column_sizes, rows)
+        with open(path, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as file:
+            yield file
+
+
+def _gzip_text_file(binary_file: BinaryIO) -> TextIO:
+    gzip_file = gzip.GzipFile(fileobj=binary_file, mode='wb', mtime=0)
+    return io.TextIOWrapper(gzip_file, encoding='utf-8')
 
 
-def _print_output_file(file: TextIO, args: Namespace, groups: Dict[str, List[int]],
-                       column_sizes: List[float], rows: List[List[Node]]) -> None:
+# Write many small texts using few large writes.
+def _write_chunked(file: TextIO, texts: Iterable[str]) -> None:
+    chunk: List[str] = []
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) == OUTPUT_CHUNK_COUNT:
+            file.write(''.join(chunk))
+            chunk.clear()
+    file.write(''.join(chunk))
+
+
+def _print_output_file(file: TextIO, args: Namespace,  # pylint: disable=too-many-arguments
+                       groups: Dict[str, List[Node]], column_sizes: List[float],
+                       rows: List[List[Node]], timeline: Optional[Timeline]) -> None:
     file.write(BEFORE_TITLE)
 
     title = args.title
@@ -782,10 +3769,73 @@ def _print_output_file(file: TextIO, args: Namespace, groups: Dict[str, List[int
             title = "Flame Graph"
     _print_title(file, title)
 
+    max_difference = _max_difference(rows)
+    colors = _compute_colors(rows, args.colors, max_difference)
+
     file.write(BEFORE_CSS)
+    _print_css(file, args, colors)
+    file.write(BEFORE_JAVASCRIPT)
+
+    data_buffer = io.StringIO()
+    _print_graph_data(data_buffer if args.compress else file, args, groups, column_sizes, rows,
+                      timeline, colors)
+
+    if args.compress:
+        graph_buffer = io.StringIO()
+        _print_graph(graph_buffer, args, rows)
+        _print_compressed_text(file, 'javascript', data_buffer.getvalue())
+        _print_compressed_text(file, 'html', graph_buffer.getvalue())
+
+    file.write(BEHAVIOR_JAVASCRIPT)
+    for javascript in RENDERERS_JAVASCRIPT[args.renderer]:
+        file.write(javascript)
+    if timeline is not None:
+        file.write(TIMELINE_JAVASCRIPT)
+    if args.compress:
+        file.write(COMPRESSED_JAVASCRIPT)
+    if args.serve is not None:
+        file.write(SERVER_JAVASCRIPT)
+    file.write(BEFORE_HTML % ('on_compressed_load' if args.compress else 'on_load'))
+
+    _print_h1(file, title)
+    if timeline is not None:
+        _print_timeline(file)
+    if args.compress:
+        file.write('<div id="compressed"></div>\n')
+    else:
+        _print_graph(file, args, rows)
 
+    file.write(AFTER_HTML)
+
+
+def _print_graph_data(file: TextIO, args: Namespace,  # pylint: disable=too-many-arguments
+                      groups: Dict[str, List[Node]], column_sizes: List[float],
+                      rows: List[List[Node]], timeline: Optional[Timeline],
+                      colors: List[str]) -> None:
+    names = _names_table(rows, args.renderer != 'dom')
+    _print_names_data(file, names)
+    _print_groups_data(file, groups, names)
+    if args.renderer == 'dom':
+        _print_cells_data(file, rows, names)
+    else:
+        _print_size_name(file, args.sizename)
+        _print_cells_data(file, rows, names, True)
+    if args.renderer == 'canvas':
+        _print_colors_data(file, colors)
+        _print_is_inverted(file, args.inverted)
+    _print_column_sizes(file, column_sizes)
+    _print_min_visible_percent(file, 0.0 if args.detailpercent is None else args.minpercent)
+    if timeline is not None:
+        _print_timeline_data(file, timeline, rows, len(column_sizes))
+    if args.serve is not None:
+        _print_whole_size(file, rows[0][0].total_size)
+
+
+def _print_css(file: TextIO, args: Namespace, colors: List[str]) -> None:
     if not args.nodefaultcss:
         file.write(DEFAULT_APPEARANCE_CSS)
+    if args.renderer != 'canvas':
+        _print_colors_css(file, colors)
     for css_path in args.addcss or []:
         try:
             with open(css_path, 'r') as css_file:
@@ -794,76 +3844,158 @@ def _print_output_file(file: TextIO, args: Namespace, groups: Dict[str, List[int
             sys.stderr.write('flameview.py: No such file or directory: %s\n' % css_path)
             sys.exit(1)
 
-    file.write(BEFORE_JAVASCRIPT)
-
-    _print_groups_data(file, groups)
-    _print_cells_data(file, rows, len(column_sizes))
-    _print_column_sizes(file, column_sizes)
-
-    file.write(BEFORE_HTML)
 
-    _print_h1(file, title)
-    if args.inverted:
-        _print_table(file, args.sizename, args.colors, rows)
+def _print_graph(file: TextIO, args: Namespace, rows: List[List[Node]]) -> None:
+    levels = list(range(len(rows)))
+    if not args.inverted:
+        levels.reverse()
+    if args.renderer == 'lazy':
+        _print_empty_table(file, levels)
+    elif args.renderer == 'canvas':
+        _print_canvas(file)
     else:
-        _print_table(file, args.sizename, args.colors, list(reversed(rows)))
+        _print_table(file, args.sizename, rows, levels)
 
-    file.write(AFTER_HTML)
+
+def _print_compressed_text(file: TextIO, kind: str, text: str) -> None:
+    file.write(dedent("""
+        // The deflate compressed, base64 encoded %s text.
+        var compressed_%s = "%s";
+    """) % (kind, kind, b64encode(zlib.compress(text.encode('utf-8'))).decode('ascii')))
+    file.write('\n')
 
 
 def _print_title(file: TextIO, title: str) -> None:
     file.write('<title>%s</title>' % title)
 
 
-def _print_groups_data(file: TextIO, groups: Dict[str, List[int]]) -> None:
+def _names_table(rows: List[List[Node]], is_detailed: bool) -> Dict[str, int]:
+    names: Dict[str, int] = {}
+    for row in rows:
+        for node in row:
+            if node.group:
+                names.setdefault(node.group, len(names))
+            if is_detailed:
+                names.setdefault(node.label, len(names))
+                names.setdefault(node.name, len(names))
+    return names
+
+
+def _print_names_data(file: TextIO, names: Dict[str, int]) -> None:
+    file.write(dedent("""
+        // The distinct names used by the cells and groups, referred to by their index.
+        var names_data = [
+    """))
+    _write_chunked(file, _names_data(names))
+    file.write('\n];\n\n')
+
+
+def _names_data(names: Dict[str, int]) -> Iterator[str]:
+    separator = '    '
+    for name in names:
+        yield separator
+        yield _js_string(name)
+        separator = ',\n    '
+
+
+def _print_groups_data(file: TextIO, groups: Dict[str, List[Node]],
+                       names: Dict[str, int]) -> None:
     file.write(dedent("""
-        // Data for each cells group:
+        // Data for each cells group (keyed by the index of its name):
         //   cell_ids: The ids of the group cells.
-        // On load, the following is computed for each group:
-        //   columns_mask: A 0/1 mask of all the columns used by the group cells.
+        //   columns_intervals: The sorted disjoint [start, end) intervals of all the
+        //   columns used by the group cells.
         var groups_data = {
     """))
-    group_lines = ['    "%s": {"cell_ids": ["%s"]}'
-                   % (group_name, '", "'.join(['N' + str(id) for id in sorted(cell_ids)]))
-                   for group_name, cell_ids in sorted(groups.items())]
+    group_lines = ['    "%s": {"cell_ids": ["%s"], "columns_intervals": [%s]}'
+                   % (names[group_name],
+                      '", "'.join(['N' + str(node.index) for node in sorted(nodes, key=_by_input)]),
+                      ', '.join(['[%s, %s]' % interval
+                                 for interval in _group_columns_intervals(nodes)]))
+                   for group_name, nodes in sorted(groups.items())]
     file.write(',\n'.join(group_lines))
     file.write('\n};\n\n')
 
 
-def _print_cells_data(file: TextIO, rows: List[List[Node]], columns_count: int) -> None:
+def _group_columns_intervals(nodes: List[Node]) -> List[Tuple[int, int]]:
+    intervals: List[Tuple[int, int]] = []
+    for node in sorted(nodes, key=_by_column):
+        start = node.column
+        end = node.column + node.columns_span
+        if intervals and start <= intervals[-1][1]:
+            if end > intervals[-1][1]:
+                intervals[-1] = (intervals[-1][0], end)
+        else:
+            intervals.append((start, end))
+    return intervals
+
+
+def _print_size_name(file: TextIO, sizename: str) -> None:
+    file.write(dedent("""
+        // The name of the size data.
+        var size_name = %s;
+    """) % _js_string(sizename))
+    file.write('\n')
+
+
+def _print_is_inverted(file: TextIO, is_inverted: bool) -> None:
+    file.write(dedent("""
+        // Whether the graph is inverted (icicles).
+        var is_inverted = %s;
+    """) % str(is_inverted).lower())
+    file.write('\n')
+
+
+def _print_cells_data(file: TextIO, rows: List[List[Node]], names: Dict[str, int],
+                      is_detailed: bool = False) -> None:
     file.write(dedent("""
         // Data for each cell:
         //   level: The stack nesting level.
-        //   columns_mask: A 0/1 mask of all the columns used by the cell.
-        //   group_id: The group the cell belongs to, if any.
-        var cells_data = {
-    """)[1:-1])
-    is_first = True
+        //   columns: The [start, span] range of the columns used by the cell.
+        //   group_id: The index of the name of the group the cell belongs to, if any.
+    """)[1:])
+    if is_detailed:
+        file.write(dedent("""
+            //   klass: The kind of the cell (leaf, self or sum).
+            //   color: The index of the background color of the cell.
+            //   label: The index of the label of the cell.
+            //   name: The index of the name of the cell, if different from the label.
+            //   tooltip: The extra tooltip HTML of the cell, if any.
+            //   difference: The size difference of the cell, if any.
+        """)[1:])
+    file.write('var cells_data = {\n    ')
+    _write_chunked(file, _cells_data(rows, names, is_detailed))
+    file.write('\n};\n')
+
+
+def _cells_data(rows: List[List[Node]], names: Dict[str, int],
+                is_detailed: bool) -> Iterator[str]:
+    separator = ''
     for level, row in enumerate(rows):
         for node in row:
-            if not is_first:
-                file.write(',')
-            file.write('\n    ')
-            _print_cell_data(file, node, columns_count, level)
-            is_first = False
-    file.write('\n};\n')
+            yield separator
+            yield _cell_data(node, level, names, is_detailed)
+            separator = ',\n    '
+
 
+def _cell_data(node: Node, level: int, names: Dict[str, int], is_detailed: bool) -> str:
+    group = '' if not node.group else ', "group_id": %s' % names[node.group]
+    if not is_detailed:
+        return '"N%s": {"level": %s, "columns": [%s, %s]%s}' \
+            % (node.index, level, node.column, node.columns_span, group)
 
-def _print_cell_data(file: TextIO, node: Node, columns_count: int, level: int) -> None:
-    file.write('"N%s": {\n' % node.index)
-    file.write('        "level": %s' % level)
-    file.write(',\n        "columns_mask": [%s]'
-               % _columns_mask(node.column, node.columns_span, columns_count))
-    if node.group:
-        file.write(',\n        "group_id": "%s"' % node.group)
-    file.write('\n    }')
+    return '"N%s": {"level": %s, "columns": [%s, %s]%s, "klass": "%s", "color": %s, ' \
+        '"label": %s%s%s%s}' \
+        % (node.index, level, node.column, node.columns_span, group, node.klass,
+           node.color, names[node.label],
+           '' if node.name == node.label else ', "name": %s' % names[node.name],
+           '' if not node.tooltip_html else ', "tooltip": %s' % _js_string(node.tooltip_html),
+           '' if node.total_difference is None
+           else ', "difference": "%+g"' % node.total_difference)
 
 
-def _columns_mask(column: int, columns_span: int, columns_count: int) -> str:
-    prefix = ["0"] * column
-    middle = ["1"] * columns_span
-    suffix = ["0"] * (columns_count - column - columns_span)
-    return ', '.join(prefix + middle + suffix)
+def _js_string(text: str) -> str:
+    return json.dumps(text).replace('</', '<\\/')
 
 
 def _print_column_sizes(file, column_sizes: List[float]) -> None:
@@ -874,146 +4006,310 @@ def _print_column_sizes(file, column_sizes: List[float]) -> None:
     file.write('\n')
 
 
+def _print_min_visible_percent(file: TextIO, min_visible_percent: float) -> None:
+    file.write(dedent("""
+        // Cells smaller than this percent of the visible size are not displayed.
+        var min_visible_percent = %s;
+    """) % _js_number(min_visible_percent))
+    file.write('\n')
+
+
+def _print_whole_size(file: TextIO, whole_size: float) -> None:
+    file.write(dedent("""
+        // The total size of the whole graph (the cells may only cover a subtree).
+        var whole_size = %s;
+    """) % _js_number(whole_size))
+    file.write('\n')
+
+
+def _print_timeline_data(file: TextIO, timeline: Timeline, rows: List[List[Node]],
+                         columns_count: int) -> None:
+    columns_ends, buckets_deltas, sizes = _timeline_entries(rows, columns_count)
+    start, duration, buckets_count = timeline
+    file.write(dedent("""
+        // The sizes of the columns over time:
+        //   start: The time (in seconds) of the start of the first bucket.
+        //   duration: The duration (in seconds) of each bucket.
+        //   buckets_count: The number of buckets.
+        //   columns_ends: For each column, the end of its entries in the following arrays.
+        //   buckets_deltas: For each entry, its bucket minus the bucket of the previous
+        //   entry of the same column (or zero for the first entry).
+        //   sizes: For each entry, the size of the column in the bucket.
+        var timeline = {
+            "start": %s,
+            "duration": %s,
+            "buckets_count": %s,
+            "columns_ends": [%s],
+            "buckets_deltas": [%s],
+            "sizes": [%s]
+        };
+    """) % (_js_number(start), _js_number(duration), buckets_count,
+            ', '.join([str(end) for end in columns_ends]),
+            ', '.join([str(delta) for delta in buckets_deltas]),
+            ', '.join([_js_number(size) for size in sizes])))
+    file.write('\n')
+
+
+def _timeline_entries(rows: List[List[Node]],
+                      columns_count: int) -> Tuple[List[int], List[int], List[float]]:
+    columns_time_sizes: List[Optional[Dict[int, float]]] = [None] * columns_count
+    for row in rows:
+        for node in row:
+            if not node.nodes:
+                columns_time_sizes[node.column] = node.time_sizes
+
+    columns_ends: List[int] = []
+    buckets_deltas: List[int] = []
+    sizes: List[float] = []
+    for time_sizes in columns_time_sizes:
+        previous_bucket = 0
+        for bucket, size in sorted((time_sizes or {}).items()):
+            buckets_deltas.append(bucket - previous_bucket)
+            sizes.append(size)
+            previous_bucket = bucket
+        columns_ends.append(len(sizes))
+    return columns_ends, buckets_deltas, sizes
+
+
+def _js_number(number: float) -> str:
+    if not math.isfinite(number):
+        raise ValueError('can\'t write a non-finite number to javascript: %s' % number)
+    return str(int(number)) if number.is_integer() else repr(number)
+
+
+def _print_timeline(file: TextIO) -> None:
+    file.write('<div id="timeline_label"></div>\n')
+    file.write('<canvas id="timeline" style="display: block"></canvas>\n')
+
+
 def _print_h1(file: TextIO, title: str) -> None:
     file.write('<h1 id="title">%s</h1>\n' % title)
 
 
-def _print_table(file: TextIO, sizename: str, palette: str, rows: List[List[Node]]) -> None:
+def _max_difference(rows: List[List[Node]]) -> Optional[float]:
+    if rows[0][0].total_difference is None:
+        return None
+    return max([abs(node.total_difference or 0.0) for row in rows[1:] for node in row] or [0.0])
+
+
+def _print_empty_table(file: TextIO, levels: List[int]) -> None:
     file.write('<div id="graph" class="tooltipped">\n')
-    for row in rows:
-        _print_row(file, sizename, palette, row)
+    for level in levels:
+        file.write('<div id="R%s" class="row">\n' % level)
+        file.write('<div class="height">&nbsp;</div>\n')
+        file.write('</div>\n')
     file.write('</div>\n')
 
 
-def _print_row(file: TextIO, sizename: str, palette: str, row: List[Node]) -> None:
-    file.write('<div class="row">\n')
-    for node in row:
-        _print_node(file, sizename, palette, node)
+def _print_canvas(file: TextIO) -> None:
+    file.write('<div id="graph" class="tooltipped" style="position: relative">\n')
+    file.write('<div id="probe" class="row">\n')
+    file.write('<div class="leaf"><div class="label">&nbsp;</div></div>\n')
     file.write('<div class="height">&nbsp;</div>\n')
     file.write('</div>\n')
+    file.write('<canvas id="canvas"></canvas>\n')
+    file.write('<div id="tooltip" class="tooltip"></div>\n')
+    file.write('</div>\n')
+
+
+def _print_table(file: TextIO, sizename: str, rows: List[List[Node]], levels: List[int]) -> None:
+    file.write('<div id="graph" class="tooltipped">\n')
+    for level in levels:
+        _print_row(file, sizename, level, rows[level])
+    file.write('</div>\n')
 
 
-def _print_node(file: TextIO, sizename: str, palette: str, node: Node) -> None:
-    file.write('<div id="N%s" class="%s"' % (node.index, node.klass))
-    file.write(' style="background-color: %s">\n' % _node_color(node, palette))
-    _print_tooltip(file, sizename, node)
-    _print_label(file, node)
+def _print_row(file: TextIO, sizename: str, level: int, row: List[Node]) -> None:
+    file.write('<div id="R%s" class="row">\n' % level)
+    _write_chunked(file, (_node_html(sizename, node) for node in row))
+    file.write('<div class="height">&nbsp;</div>\n')
     file.write('</div>\n')
 
 
-def _node_color(node: Node, palette: str) -> str:
-    if len(node.label) == 1:
+def _node_html(sizename: str, node: Node) -> str:
+    return '<div id="N%s" class="%s C%s">\n%s%s</div>\n' \
+        % (node.index, node.klass, node.color, _tooltip_html(sizename, node), _label_html(node))
+
+
+# Set the color index of each node and return the distinct colors. Each label always gets the same
+# color, unless the color depends on the difference of the node.
+def _compute_colors(rows: List[List[Node]], palette: str,
+                    max_difference: Optional[float]) -> List[str]:
+    colors: Dict[str, int] = {}
+    labels_colors: Dict[str, int] = {}
+    for row in rows:
+        for node in row:
+            if max_difference is not None and len(node.label) > 1:
+                red, green, blue = _difference_color(node.total_difference or 0.0,
+                                                     max_difference)
+                color = 'rgb(%d, %d, %d)' % (red, green, blue)
+                node.color = colors.setdefault(color, len(colors))
+                continue
+
+            color_index = labels_colors.get(node.label)
+            if color_index is None:
+                color = _label_color(node.label, palette)
+                color_index = labels_colors[node.label] = colors.setdefault(color, len(colors))
+            node.color = color_index
+    return list(colors)
+
+
+def _label_color(label: str, palette: str) -> str:
+    if len(label) == 1:
         red, green, blue = 160.0, 160.0, 160.0
     else:
-        red, green, blue = {
-            'hot': _hot_color,
-            'mem': _mem_color,
-            'io': _io_color,
-            'red': _red_color,
-            'green': _green_color,
-            'blue': _blue_color,
-            'aqua': _aqua_color,
-            'yellow': _yellow_color,
-            'purple': _purple_color,
-            'orange': _orange_color,
-        }[palette]()
+        first = _name_hash(label)
+        second = _name_hash(label[::-1])
+        red, green, blue = PALETTES[palette](first, second, second)
     return 'rgb(%d, %d, %d)' % (red, green, blue)
 
 
+MODULE_REGEXP = re.compile(r'.(.*?)`')
+
+
+# Hash a name to a fraction, weighting early characters over later ones (as in flamegraph.pl).
+def _name_hash(name: str) -> float:
+    name = MODULE_REGEXP.sub('', name, count=1)
+    vector = 0.0
+    weight = 1.0
+    maximum = 1.0
+    modulo = 10
+    for character in name:
+        vector += (ord(character) % modulo) / (modulo - 1) * weight
+        modulo += 1
+        maximum += weight
+        weight *= 0.70
+        if modulo > 12:
+            break
+    return 1 - vector / maximum
+
+
+def _print_colors_css(file: TextIO, colors: List[str]) -> None:
+    file.write('\n/*** Colors: ***/\n\n')
+    for index, color in enumerate(colors):
+        file.write('.C%s {\n    background-color: %s;\n}\n' % (index, color))
+
+
+def _print_colors_data(file: TextIO, colors: List[str]) -> None:
+    file.write(dedent("""
+        // The background colors of the cells.
+        var colors_data = [%s];
+    """) % ', '.join(['"%s"' % color for color in colors]))
+    file.write('\n')
+
+
+# Differential colors were copied from flamegraph.pl:
+
+
+def _difference_color(difference: float, max_difference: float) -> Tuple[float, float, float]:
+    if difference == 0 or max_difference == 0:
+        return 255.0, 255.0, 255.0
+    fade = 210 * (max_difference - abs(difference)) / max_difference
+    if difference > 0:
+        return 255.0, fade, fade
+    return fade, fade, 255.0
+
+
 # Palettes were copied from flamegraph.pl:
 
 
-def _hot_color() -> Tuple[float, float, float]:
-    red = 205 + 50 * random()
-    green = 230 * random()
-    blue = 55 * random()
+def _hot_color(first: float, second: float, third: float) -> Tuple[float, float, float]:
+    red = 205 + 50 * third
+    green = 230 * first
+    blue = 55 * second
     return red, green, blue
 
 
-def _mem_color() -> Tuple[float, float, float]:
+def _mem_color(first: float, second: float, _third: float) -> Tuple[float, float, float]:
     red = 0.0
-    green = 190 + 50 * random()
-    blue = 210 * random()
+    green = 190 + 50 * second
+    blue = 210 * first
     return red, green, blue
 
 
-def _io_color() -> Tuple[float, float, float]:
-    red = 80 + 60 * random()
+def _io_color(first: float, second: float, _third: float) -> Tuple[float, float, float]:
+    red = 80 + 60 * first
     green = red
-    blue = 190 + 55 * random()
+    blue = 190 + 55 * second
     return red, green, blue
 
 
-def _red_color() -> Tuple[float, float, float]:
-    fraction = random()
+def _red_color(fraction: float, _second: float, _third: float) -> Tuple[float, float, float]:
     red = 200 + 55 * fraction
     green = 50 + 80 * fraction
     blue = green
     return red, green, blue
 
 
-def _green_color() -> Tuple[float, float, float]:
-    fraction = random()
+def _green_color(fraction: float, _second: float, _third: float) -> Tuple[float, float, float]:
     red = 50 + 60 * fraction
     green = 200 + 55 * fraction
     blue = red
     return red, green, blue
 
 
-def _blue_color() -> Tuple[float, float, float]:
-    fraction = random()
+def _blue_color(fraction: float, _second: float, _third: float) -> Tuple[float, float, float]:
     red = 80 + 60 * fraction
     green = red
     blue = 205 + 50 * fraction
     return red, green, blue
 
 
-def _yellow_color() -> Tuple[float, float, float]:
-    fraction = random()
+def _yellow_color(fraction: float, _second: float, _third: float) -> Tuple[float, float, float]:
     red = 175 + 55 * fraction
     green = red
     blue = 50 + 20 * fraction
     return red, green, blue
 
 
-def _purple_color() -> Tuple[float, float, float]:
-    fraction = random()
+def _purple_color(fraction: float, _second: float, _third: float) -> Tuple[float, float, float]:
     red = 190 + 65 * fraction
     green = 80 + 60 * fraction
     blue = red
     return red, green, blue
 
 
-def _aqua_color() -> Tuple[float, float, float]:
-    fraction = random()
+def _aqua_color(fraction: float, _second: float, _third: float) -> Tuple[float, float, float]:
     red = 50 + 60 * fraction
     green = 165 + 55 * fraction
     blue = green
     return red, green, blue
 
 
-def _orange_color() -> Tuple[float, float, float]:
-    fraction = random()
+def _orange_color(fraction: float, _second: float, _third: float) -> Tuple[float, float, float]:
     red = 190 + 65 * fraction
     green = 90 + 65 * fraction
     blue = 0.0
     return red, green, blue
 
 
-def _print_tooltip(file: TextIO, sizename: str, node: Node) -> None:
-    file.write('<div class="tooltip">\n')
-    file.write('<span class="name">%s</span><br/>\n' % _escape(node.name))
-    file.write('<hr/>\n')
-    file.write('<div class="basic">%s: <span class="computed"></span></div>\n' % sizename)
-    if node.tooltip_html:
-        file.write('<div class="extra">\n')
-        file.write(node.tooltip_html)
-        file.write('</div>\n')
-    file.write('</div>\n')
+PALETTES: Dict[str, Callable[[float, float, float], Tuple[float, float, float]]] = {
+    'hot': _hot_color,
+    'mem': _mem_color,
+    'io': _io_color,
+    'red': _red_color,
+    'green': _green_color,
+    'blue': _blue_color,
+    'aqua': _aqua_color,
+    'yellow': _yellow_color,
+    'purple': _purple_color,
+    'orange': _orange_color,
+}
+
+
+def _tooltip_html(sizename: str, node: Node) -> str:
+    return '<div class="tooltip">\n<span class="name">%s</span><br/>\n<hr/>\n' \
+        '<div class="basic">%s: <span class="computed"></span></div>\n%s%s</div>\n' \
+        % (_escape(node.name), sizename,
+           '' if node.total_difference is None
+           else '<div class="difference">%s difference: %+g</div>\n'
+           % (sizename, node.total_difference),
+           '' if not node.tooltip_html
+           else '<div class="extra">\n%s</div>\n' % node.tooltip_html)
 
 
-def _print_label(file: TextIO, node: Node) -> None:
-    file.write('<div class="label">%s</div>\n' % _escape(node.label))
+def _label_html(node: Node) -> str:
+    return '<div class="label">%s</div>\n' % _escape(node.label)
 
 
 def _escape(text: str) -> str:
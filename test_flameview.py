@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+"""
+Tests for flameview.py.
+"""
+
+import gzip
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from array import array
+from typing import Any
+from typing import List
+from typing import Tuple
+
+import flameview
+
+# pylint: disable=missing-docstring
+# pylint: disable=protected-access
+
+FOLDED_TEXT = '''\
+main;parse;read 10
+main;parse 5
+main;render;write 7 # <b>tooltip</b>
+'''
+
+
+def _folded_root() -> flameview.Node:
+    return flameview._load_data_file('test', True, 'folded', None, io.StringIO(FOLDED_TEXT))
+
+
+def _tree_paths(root: flameview.Node) -> List[Any]:
+    paths: List[Any] = []
+    stack: List[Any] = [((root.name,), root)]
+    while stack:
+        names, node = stack.pop()
+        paths.append((names, node.size, node.tooltip_html))
+        for child in node.nodes.values():
+            stack.append((names + (child.name,), child))
+    return sorted(paths)
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.cache')
+        self.key = {'test': 1}
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def _write_cache(self, header: Any, sections: List[array]) -> None:
+        header_data = json.dumps(header).encode('utf-8')
+        with open(self.path, 'wb') as file:
+            file.write(flameview.CACHE_MAGIC)
+            file.write(struct.pack('=Q', len(header_data)))
+            file.write(header_data)
+            flameview._pad_cache_file(file)
+            for section in sections:
+                section.tofile(file)
+                flameview._pad_cache_file(file)
+
+    def _header(self, sections: List[array]) -> Any:
+        return {'key': self.key,
+                'sections': [(section.typecode, len(section)) for section in sections]}
+
+    def test_round_trip(self) -> None:
+        root = _folded_root()
+        flameview._save_cache_file(self.path, self.key, root)
+        loaded = flameview._load_cache_file(self.path, self.key)
+        assert loaded is not None
+        self.assertEqual(_tree_paths(loaded), _tree_paths(root))
+
+    def test_different_key(self) -> None:
+        flameview._save_cache_file(self.path, self.key, _folded_root())
+        self.assertIsNone(flameview._load_cache_file(self.path, {'test': 2}))
+
+    def test_truncated(self) -> None:
+        flameview._save_cache_file(self.path, self.key, _folded_root())
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        for size in range(len(data.rstrip(b'\0')) - 1, -1, -1):
+            with open(self.path, 'wb') as file:
+                file.write(data[:size])
+            self.assertIsNone(flameview._load_cache_file(self.path, self.key), size)
+
+    def test_garbled_header(self) -> None:
+        sections = flameview._cache_sections(_folded_root())
+        header = self._header(sections)
+        for garbled in [{'sections': header['sections']},
+                        {'key': self.key},
+                        [self.key, header['sections']],
+                        {'key': self.key, 'sections': header['sections'][:-1]},
+                        {'key': self.key, 'sections': header['sections'] + [('B', 0)]},
+                        {'key': self.key, 'sections': [7] * len(sections)},
+                        {'key': self.key, 'sections': [('d', 1)] * len(sections)},
+                        {'key': self.key, 'sections': [(section.typecode, -1)
+                                                       for section in sections]}]:
+            self._write_cache(garbled, sections)
+            self.assertIsNone(flameview._load_cache_file(self.path, self.key), garbled)
+
+    def test_garbled_sections(self) -> None:
+        for index, position, value in [(0, 0, 0), (0, -1, -2), (0, -1, 100), (0, 2, 2),
+                                       (1, -1, 100), (1, -1, -1), (2, -1, 100), (2, -1, -1)]:
+            sections = flameview._cache_sections(_folded_root())
+            sections[index][position] = value
+            self._write_cache(self._header(sections), sections)
+            self.assertIsNone(flameview._load_cache_file(self.path, self.key),
+                              (index, position, value))
+
+    def test_mismatched_sections(self) -> None:
+        sections = flameview._cache_sections(_folded_root())
+        sections[3].pop()
+        self._write_cache(self._header(sections), sections)
+        self.assertIsNone(flameview._load_cache_file(self.path, self.key))
+
+
+def _varint(value: int) -> bytes:
+    data = bytearray()
+    while value >= 0x80:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def _message(*fields: Tuple[int, Any]) -> bytes:
+    data = b''
+    for number, value in fields:
+        if isinstance(value, int):
+            data += _varint(number << 3) + _varint(value)
+        else:
+            data += _varint(number << 3 | 2) + _varint(len(value)) + value
+    return data
+
+
+def _packed(values: List[int]) -> bytes:
+    return b''.join(_varint(value) for value in values)
+
+
+# The fields of a profile after its head fields, with the stacks main;work;leaf of 5 samples and
+# main;work of 2 samples, where each sample is 10 units.
+def _pprof_tail_fields() -> List[Tuple[int, Any]]:
+    strings = ['', 'samples', 'count', 'cpu', 'nanoseconds', 'main', 'work', 'leaf']
+    return [(2, _message((1, _packed([3, 2, 1])), (2, _packed([5, 50])))),
+            (2, _message((1, _packed([2, 1])), (2, _packed([2, 20]))))] \
+        + [(4, _message((1, index), (3, 0x1000 + index), (4, _message((1, index)))))
+           for index in (1, 2, 3)] \
+        + [(5, _message((1, index), (2, index + 4))) for index in (1, 2, 3)] \
+        + [(6, text.encode('utf-8')) for text in strings]
+
+
+# A Go CPU profile starts with the time (field 9), followed by the sample types.
+def _go_cpu_profile() -> bytes:
+    return _message((9, 1700000000000000000),
+                    (1, _message((1, 1), (2, 2))), (1, _message((1, 3), (2, 4))),
+                    (10, 1000000000), (11, _message((1, 3), (2, 4))), (12, 10000000),
+                    *_pprof_tail_fields())
+
+
+# A Go heap profile starts with the period type (field 11).
+def _go_heap_profile() -> bytes:
+    return _message((11, _message((1, 1), (2, 2))), (12, 524288),
+                    (1, _message((1, 1), (2, 2))), (1, _message((1, 3), (2, 4))),
+                    *_pprof_tail_fields())
+
+
+def _binary_text_file(data: bytes) -> Any:
+    return flameview._open_text_file('profile', io.BufferedReader(io.BytesIO(data)))
+
+
+class TestFormatDetection(unittest.TestCase):
+
+    def _assert_pprof(self, data: bytes) -> None:
+        for file_data in (data, gzip.compress(data)):
+            with _binary_text_file(file_data) as file:
+                self.assertEqual(flameview._detect_input_format('profile', file), 'pprof')
+                records = flameview._read_data_file('profile', True, 'auto', None, file)
+                self.assertEqual(sorted((names, size) for _, names, size, _, _ in records),
+                                 [(['main', 'work'], 20.0), (['main', 'work', 'leaf'], 50.0)])
+
+    def test_go_cpu_profile(self) -> None:
+        self._assert_pprof(_go_cpu_profile())
+
+    def test_go_heap_profile(self) -> None:
+        self._assert_pprof(_go_heap_profile())
+
+    def test_folded(self) -> None:
+        for text in [FOLDED_TEXT,
+                     '8.267000 a;b4;c8 1\n8.268000 a;b17;c7 6\n8.269000 a;b4;c5 6\n']:
+            with _binary_text_file(text.encode('utf-8')) as file:
+                self.assertEqual(flameview._detect_input_format('profile', file), 'folded')
+
+
+if __name__ == '__main__':
+    unittest.main()